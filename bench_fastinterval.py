@@ -0,0 +1,333 @@
+"""
+Benchmarks for fastinterval.
+
+Run all the benchmarks, or just those named, with::
+
+    python bench_fastinterval.py [name ...]
+
+Each benchmark builds its own synthetic data in a temporary directory.
+
+The scaling benchmark times the hot paths (merge, coverage, the spanning
+set solvers, from_string and Interval.sequence) on synthetic intervals at
+several scales, each in a fresh process, and records the time and the peak
+memory of each operation.  The results are compared with the baseline in
+bench_fastinterval.json, and operations that slow down or grow faster than
+linearly, or that run out of time, are flagged::
+
+    python bench_fastinterval.py scaling --scales 1e3,1e4,1e5,1e6,1e7
+    python bench_fastinterval.py scaling --save
+
+Without --scales each operation runs up to the largest scale its baseline
+completed, and timeouts only warn at scales the baseline finished.
+
+Baselines are machine specific, so save a new one before comparing on a
+different machine.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(ROOT, 'bench_fastinterval.json')
+
+def make_genome(dirname, n_chroms=20, length=1000000, seed=0):
+    """ write a random fasta file and return its name """
+    rand = random.Random(seed)
+    fname = os.path.join(dirname, 'synthetic.fa')
+    with open(fname, 'w') as fh:
+        for i in range(n_chroms):
+            fh.write('>chr%s\n' % (i + 1))
+            line = ''.join(rand.choice('ACGT') for j in range(60)) + '\n'
+            fh.write(line * (length // 60))
+    return fname
+
+def make_intervals(n, n_chroms=20, length=1000000, width=(50, 500), seed=0, **kws):
+    """ return n random intervals on a genome from make_genome, any kws
+    are passed to Interval """
+    import numpy as np
+    from fastinterval import Interval
+    rand = np.random.RandomState(seed)
+    chroms = ['chr%s' % (i + 1) for i in range(n_chroms)]
+    codes = rand.randint(0, n_chroms, n).tolist()
+    widths = rand.randint(width[0], width[1], n)
+    starts = rand.randint(0, length - width[1], n)
+    strands = rand.choice([1, -1], n).tolist()
+    return [
+        Interval(start, end, chrom=chroms[code], strand=strand, **kws)
+        for code, start, end, strand
+        in zip(codes, starts.tolist(), (starts + widths).tolist(), strands)
+    ]
+
+def run_python(code):
+    """ run code in a fresh interpreter and return its stdout """
+    return subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+
+STARTUP = """
+import time
+start = time.time()
+import fastinterval
+genome = fastinterval.Genome(%r, lazy=%r)
+genome.interval(1000, 1100, chrom='chr7').sequence
+print time.time() - start
+"""
+
+def bench_startup(args, repeat=5):
+    """ time a fresh process importing fastinterval, opening a genome with an
+    existing index and fetching one sequence, with and without lazy=True """
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = make_genome(tmp)
+        run_python(STARTUP % (fname, False))
+        for lazy in (False, True):
+            times = [float(run_python(STARTUP % (fname, lazy))) for i in range(repeat)]
+            print 'startup lazy=%s: best %.4fs of %s' % (lazy, min(times), repeat)
+    finally:
+        shutil.rmtree(tmp)
+
+INTERVALS = """
+import resource, time
+import fastinterval
+chroms = ['chr%%s' %% (i + 1) for i in range(20)]
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+intervals = [
+    fastinterval.%s(i, i + 100, chrom=chroms[i %% 20], strand=1)
+    for i in xrange(%s)
+]
+elapsed = time.time() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print elapsed, (after - before) * 1024.0 / len(intervals)
+"""
+
+def bench_memory(args, n=1000000):
+    """ compare the resident bytes per interval and construction rate of
+    Interval and CompactInterval, each in a fresh process """
+    for cls in ('Interval', 'CompactInterval'):
+        elapsed, size = map(float, run_python(INTERVALS % (cls, n)).split())
+        print '%s: %.0f bytes/interval, %.0f intervals/s' % (cls, size, n / elapsed)
+
+# each operation is set up from a number of intervals and a fasta file name,
+# and returns the function to time
+
+def setup_merge(n, fname):
+    from fastinterval import Interval
+    intervals = make_intervals(n)
+    return lambda: Interval.merge(intervals)
+
+def setup_coverage(n, fname):
+    from fastinterval import Interval
+    intervals = make_intervals(n)
+    return lambda: Interval.coverage(intervals)
+
+def _spanning_set(solver, components=False):
+    def setup(n, fname):
+        from fastinterval import MinimalSpanningSet
+        targets = make_intervals(max(n // 10, 1), width=(200, 2000), seed=1)
+        candidates = make_intervals(n)
+        return lambda: MinimalSpanningSet(targets, list(candidates), solver=solver,
+            components=components)
+    return setup
+
+def setup_from_string(n, fname):
+    from fastinterval import Interval
+    strings = [str(x) for x in make_intervals(n)]
+    return lambda: [Interval.from_string(x) for x in strings]
+
+def setup_sequence(n, fname):
+    from fastinterval import Genome
+    genome = Genome(fname)
+    intervals = make_intervals(n, genome=genome)
+    return lambda: [x.sequence for x in intervals]
+
+# name: (setup, largest number of intervals)
+OPERATIONS = dict(
+    merge = (setup_merge, 10 ** 7),
+    coverage = (setup_coverage, 10 ** 7),
+    spanning_set = (_spanning_set('greedy'), 10 ** 4),
+    spanning_set_lazy = (_spanning_set('lazy'), 10 ** 6),
+    spanning_set_components = (_spanning_set('greedy', components=True), 10 ** 6),
+    from_string = (setup_from_string, 10 ** 7),
+    sequence = (setup_sequence, 10 ** 6),
+)
+
+DEFAULT_SCALES = '1e3,1e4,1e5,1e6'
+
+def run_operation(name, n, fname):
+    """ time an operation in this process and print the seconds and the peak
+    memory it used in bytes, as json """
+    func = OPERATIONS[name][0](n, fname)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux
+    print json.dumps(dict(seconds=elapsed, peak_bytes=(after - before) * 1024))
+
+def measure(name, n, fname, timeout=None):
+    """ run an operation in a fresh process and return its measurements, or
+    None if it takes longer than timeout seconds """
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', name, str(n), fname],
+        cwd=ROOT, stdout=subprocess.PIPE)
+    start = time.time()
+    while child.poll() is None:
+        if timeout is not None and time.time() - start > timeout:
+            child.kill()
+            child.wait()
+            return None
+        time.sleep(0.01)
+    output = child.stdout.read()
+    if child.returncode:
+        raise Exception('%s n=%s failed' % (name, n))
+    return json.loads(output.splitlines()[-1])
+
+def slope(small, large):
+    """ return the log-log slope between two (n, seconds) points """
+    (n1, t1), (n2, t2) = small, large
+    return math.log(max(t2, 1e-6) / max(t1, 1e-6)) / math.log(float(n2) / n1)
+
+def compare(results, baseline, tolerance=0.25, max_slope=1.5, min_seconds=0.05,
+        min_bytes=4 * 2 ** 20):
+    """ return warnings for results slower or larger than the baseline, for
+    operations growing faster than linearly and faster than in the baseline,
+    and for runs that timed out or were skipped at scales the baseline
+    completed
+
+    Times under min_seconds and growth in peak memory under min_bytes are
+    not compared, as ru_maxrss is noisy at that size.
+    """
+    warnings = []
+    for name, runs in sorted(results.items()):
+        old = baseline.get(name, {})
+        for n, run in sorted(runs.items(), key=lambda x: int(x[0])):
+            if n not in old or 'seconds' not in run or 'seconds' not in old[n]:
+                continue
+            if run['seconds'] > old[n]['seconds'] * (1 + tolerance) and run['seconds'] > min_seconds:
+                warnings.append('%s n=%s: seconds %.3g, baseline %.3g' % (
+                    name, n, run['seconds'], old[n]['seconds']))
+            if (run['peak_bytes'] > old[n]['peak_bytes'] * (1 + tolerance)
+                    and run['peak_bytes'] - old[n]['peak_bytes'] > min_bytes):
+                warnings.append('%s n=%s: peak_bytes %.3g, baseline %.3g' % (
+                    name, n, run['peak_bytes'], old[n]['peak_bytes']))
+
+        points = [
+            (int(n), run['seconds']) for n, run in runs.items() if 'seconds' in run
+        ]
+        points.sort()
+        old_seconds = dict((int(n), run['seconds']) for n, run in old.items() if 'seconds' in run)
+        for small, large in zip(points, points[1:]):
+            if small[0] in old_seconds and large[0] in old_seconds:
+                known = slope((small[0], old_seconds[small[0]]), (large[0], old_seconds[large[0]]))
+                if slope(small, large) <= known + tolerance:
+                    continue
+            if large[1] > min_seconds and slope(small, large) > max_slope:
+                warnings.append('%s: time grows as n^%.2f from n=%s to n=%s' % (
+                    name, slope(small, large), small[0], large[0]))
+        for reason in ('timed_out', 'skipped'):
+            sizes = sorted([
+                n for n, run in runs.items()
+                if run.get(reason) and 'seconds' in old.get(n, {})
+            ], key=int)
+            if sizes:
+                warnings.append('%s: %s n=%s' % (name, reason.replace('_', ' '), ','.join(sizes)))
+    return warnings
+
+def completed(runs):
+    """ return the largest number of intervals a baseline operation finished,
+    or None if it has no runs """
+    sizes = [int(n) for n, run in runs.items() if 'seconds' in run]
+    return max(sizes) if sizes else None
+
+def bench_scaling(args):
+    """ time each operation at each scale and compare with the baseline
+
+    Without --scales each operation stops at the largest scale its baseline
+    completed, so a known timeout is not rerun.
+    """
+    names = args.operations.split(',') if args.operations else sorted(OPERATIONS)
+    scales = [int(float(x)) for x in (args.scales or DEFAULT_SCALES).split(',')]
+    baseline = {}
+    if os.path.exists(args.baseline):
+        baseline = json.load(open(args.baseline))
+    tmp = tempfile.mkdtemp()
+    results = {}
+    try:
+        fname = make_genome(tmp)
+        # build the index once so it is not timed
+        run_python('import fastinterval; fastinterval.Genome(%r)' % fname)
+        for name in names:
+            results[name] = runs = {}
+            over_budget = False
+            largest = OPERATIONS[name][1]
+            if args.scales is None and completed(baseline.get(name, {})):
+                largest = min(largest, completed(baseline[name]))
+            for n in scales:
+                if n > largest:
+                    continue
+                if over_budget:
+                    runs[str(n)] = dict(skipped=True)
+                    continue
+                run = measure(name, n, fname, args.timeout)
+                if run is None:
+                    runs[str(n)] = dict(timed_out=True)
+                    over_budget = True
+                    print '%-18s n=%-9s timed out after %ss' % (name, n, args.timeout)
+                    continue
+                runs[str(n)] = run
+                print '%-18s n=%-9s %10.4fs %8.1fMB %10.3gs/interval' % (
+                    name, n, run['seconds'], run['peak_bytes'] / 1e6, run['seconds'] / n)
+                over_budget = run['seconds'] > args.budget
+    finally:
+        shutil.rmtree(tmp)
+
+    warnings = compare(results, baseline, args.tolerance)
+    for warning in warnings:
+        print 'WARNING', warning
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True, separators=(',', ': '))
+            fh.write('\n')
+    return warnings
+
+BENCHMARKS = dict(
+    startup = bench_startup,
+    memory = bench_memory,
+    scaling = bench_scaling,
+)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks for fastinterval')
+    parser.add_argument('names', nargs='*', help='benchmarks to run: %s' % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--operations', help='comma separated operations for scaling: %s' % ', '.join(sorted(OPERATIONS)))
+    parser.add_argument('--scales', help='comma separated numbers of intervals, default %s up to the largest each baseline completed' % DEFAULT_SCALES)
+    parser.add_argument('--baseline', default=BASELINE, help='json file of baseline results')
+    parser.add_argument('--save', action='store_true', help='save the results to the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slow down relative to the baseline')
+    parser.add_argument('--budget', type=float, default=60, help='skip larger scales after a run takes this many seconds')
+    parser.add_argument('--timeout', type=float, default=120, help='stop a run after this many seconds')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        name, n, fname = args.child
+        run_operation(name, int(n), fname)
+        return 0
+
+    warnings = []
+    for name in args.names or sorted(BENCHMARKS):
+        warnings.extend(BENCHMARKS[name](args) or [])
+    return 1 if warnings else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
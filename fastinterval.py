@@ -54,21 +54,496 @@ so on.
     >>> tree.find(190, 195)
     [Interval(150, 200, value=foo)]
 
+Large numbers of intervals can be held in an `IntervalArray`, which stores
+the coordinates in numpy arrays and provides vectorized interval operations::
+
+    >>> arr = test_genome.interval_array([100, 200], [150, 250], chrom='1')
+    >>> arr.overlaps(int2).tolist()
+    [True, False]
+    >>> arr.distance(int2).tolist()
+    [0.0, 25.0]
+    >>> arr.to_intervals()
+    [Interval(100, 150), Interval(200, 250)]
+
 """
 
 VERSION = '0.1.1'
 
-from pyfasta import Fasta
+import cPickle
+import functools
+import gzip
+import heapq
+import mmap
+import os
+import re
+import string
+import struct
+import tempfile
+import time
+from collections import Mapping, deque
+from itertools import chain, islice
+from bisect import bisect_left, bisect_right
+
+import numpy as np
 from bx.intervals import Interval as BaseInterval
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    class OrderedDict(dict):
+        """ enough of an OrderedDict for python 2.6: a dict with a deque of
+        (serial, key) in insertion order, skipping stale entries """
+
+        def __init__(self):
+            dict.__init__(self)
+            self.order = deque()
+            self.serials = {}
+            self.serial = 0
+
+        def __setitem__(self, key, value):
+            if key not in self:
+                self.serial += 1
+                self.serials[key] = self.serial
+                self.order.append((self.serial, key))
+            dict.__setitem__(self, key, value)
+
+        def __delitem__(self, key):
+            dict.__delitem__(self, key)
+            del self.serials[key]
+            if len(self.order) > 2 * len(self) + 16:
+                self.order = deque(x for x in self.order if self.serials.get(x[1]) == x[0])
+
+        def __iter__(self):
+            return (key for serial, key in list(self.order) if self.serials.get(key) == serial)
+
+        def keys(self):
+            return list(self)
+
+        def pop(self, key, *default):
+            if key not in self:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+
+        def popitem(self, last=True):
+            while self.order:
+                serial, key = self.order.pop() if last else self.order.popleft()
+                if self.serials.get(key) == serial:
+                    return key, self.pop(key)
+            raise KeyError('dictionary is empty')
+
+        def clear(self):
+            dict.clear(self)
+            self.order.clear()
+            self.serials.clear()
+
+# instrumentation of the hot paths, off (None) unless enable_stats is called
+_STATS = None
+_STATS_HOOKS = []
+
+def enable_stats():
+    """ start counting calls, bytes, cache hits, solver iterations and time
+    in the hot paths, see stats """
+    global _STATS
+    if _STATS is None:
+        _STATS = {}
+
+def disable_stats():
+    """ stop counting and discard the counters """
+    global _STATS
+    _STATS = None
+
+def reset_stats():
+    """ set all the counters back to zero """
+    if _STATS is not None:
+        _STATS.clear()
+
+def stats():
+    """ return a snapshot of the counters as a dict of name: value
+
+    The names are operation.counter, for example fetch.calls, fetch.bytes,
+    cache.hits, merge.seconds, spanning_set.iterations and
+    spanning_set.rescored.  The dict is empty unless enable_stats has been
+    called.
+    """
+    return dict(_STATS or {})
+
+def add_stats_hook(func):
+    """ call func(name, increment) on every counter update while stats are
+    enabled, e.g. to forward them to a metrics system """
+    _STATS_HOOKS.append(func)
+
+def remove_stats_hook(func):
+    """ stop calling a function added with add_stats_hook """
+    _STATS_HOOKS.remove(func)
+
+def _count(name, increment=1):
+    """ add to a counter, only call when _STATS is not None """
+    _STATS[name] = _STATS.get(name, 0) + increment
+    for hook in _STATS_HOOKS:
+        hook(name, increment)
+
+def _timed(name):
+    """ decorate a function to count its calls and time when stats are enabled """
+    def decorate(func):
+        @functools.wraps(func)
+        def timed(*args, **kws):
+            if _STATS is None:
+                return func(*args, **kws)
+            start = time.time()
+            try:
+                return func(*args, **kws)
+            finally:
+                _count(name + '.calls')
+                _count(name + '.seconds', time.time() - start)
+        return timed
+    return decorate
+
 def _convert_strand(strand):
     """ convert UCSC +/- to +1/-1"""
     if strand == '-': return -1
     if strand == '+': return 1
     return strand
 
-class Interval(BaseInterval):
-    """ A genomic interval """
+# a unicode table translates both str and unicode, see pyfasta
+_COMPLEMENT = string.maketrans('ACGTacgt', 'TGCAtgca').decode('latin-1')
+
+def _reverse_complement(seq):
+    """ reverse complement a DNA string """
+    return seq.translate(_COMPLEMENT)[::-1]
+
+# uint8 lookup tables to upper case and to complement (and upper case) bases
+_UPPER_CODES = np.arange(256, dtype=np.uint8)
+_UPPER_CODES[ord('a'):ord('z') + 1] -= 32
+_COMPLEMENT_CODES = _UPPER_CODES.copy()
+for _base, _other in zip('ACGTacgt', 'TGCATGCA'):
+    _COMPLEMENT_CODES[ord(_base)] = ord(_other)
+del _base, _other
+
+def _flat_bases(fasta, chrom):
+    """ return a uint8 array of a chromosome in a flattened fasta, sharing
+    memory with the mmap, or None if fasta is not memory mapped """
+    if isinstance(fasta, FlatFile):
+        return fasta.bases(chrom)
+    prepared = getattr(fasta, 'prepared', None)
+    if isinstance(prepared, np.ndarray):
+        start, stop = fasta.index[chrom]
+        return prepared[start:stop].view(np.uint8)
+    return None
+
+_MADV_WILLNEED = 3
+_madvise = []
+
+def _get_madvise():
+    """ return libc madvise through ctypes, or None where it is unavailable """
+    if not _madvise:
+        try:
+            import ctypes, ctypes.util
+            func = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).madvise
+            func.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+            _madvise.append(func)
+        except (ImportError, OSError, AttributeError):
+            _madvise.append(None)
+    return _madvise[0]
+
+def _region_bytes(fasta, chrom, start, end):
+    """ return the memory mapped uint8 array holding a region, or None """
+    if isinstance(fasta, TwoBitFile):
+        data, start, end = fasta[chrom].packed, start // 4, (end + 3) // 4
+    else:
+        data = _flat_bases(fasta, chrom)
+        if data is None:
+            return None
+    start = min(max(start, 0), len(data))
+    return data[start:max(start, end)]
+
+def _page_in(region):
+    """ advise the kernel to read in the pages of a memory mapped array, then
+    touch a byte in each page so they are resident when the region is read """
+    if region is None or not len(region):
+        return
+    madvise = _get_madvise()
+    if madvise is not None:
+        address = region.ctypes.data
+        aligned = address - address % mmap.PAGESIZE
+        madvise(aligned, address + len(region) - aligned, _MADV_WILLNEED)
+    region[::mmap.PAGESIZE].max()
+
+@_timed('sequences')
+def _fetch_sequences(fasta, intervals):
+    """ return the upper case sequences of an IntervalArray from a Fasta
+
+    Coordinates are clipped to the chromosome.  With a memory mapped flat
+    file the intervals are read in file order, otherwise through pyfasta.
+    """
+    if not (isinstance(fasta, FlatFile) or isinstance(getattr(fasta, 'prepared', None), np.ndarray)):
+        result = [
+            fasta.sequence(dict(start=x.start, stop=x.end, chr=x.chrom, strand=x.strand),
+                one_based=False).upper()
+            for x in intervals
+        ]
+        if _STATS is not None:
+            _count('sequences.bytes', sum(map(len, result)))
+        return result
+
+    index = [fasta.index[chrom] for chrom in intervals.chroms]
+    offsets = np.array([x[0] for x in index], dtype=np.int64)[intervals.chrom_codes]
+    lengths = np.array([x[1] - x[0] for x in index], dtype=np.int64)[intervals.chrom_codes]
+    starts = offsets + np.clip(intervals.starts, 0, lengths)
+    ends = offsets + np.clip(intervals.ends, 0, lengths)
+    reverse = intervals.strands < 0
+
+    bases = [_flat_bases(fasta, chrom) for chrom in intervals.chroms]
+    codes = intervals.chrom_codes
+    result = [None] * len(intervals)
+    for i in np.argsort(starts, kind='mergesort'):
+        flat, offset = bases[codes[i]], offsets[i]
+        seq = flat[starts[i] - offset:max(starts[i], ends[i]) - offset].tostring().decode().upper()
+        if reverse[i]:
+            seq = _reverse_complement(seq)
+        result[i] = seq
+    if _STATS is not None:
+        _count('sequences.bytes', int(np.maximum(ends - starts, 0).sum()))
+    return result
+
+def _depth(starts, ends):
+    """ sweep start and end events and return (starts, ends, depths) arrays
+    for the runs of constant, non-zero depth """
+    positions = np.concatenate((starts, ends))
+    deltas = np.repeat(np.array([1, -1], dtype=np.int64), [len(starts), len(ends)])
+    order = np.argsort(positions, kind='mergesort')
+    positions = positions[order]
+    depths = np.cumsum(deltas[order])
+
+    # the depth after the last event at each position, then only where it changes
+    last = np.append(positions[1:] != positions[:-1], True)
+    positions, depths = positions[last], depths[last]
+    change = np.append(True, depths[1:] != depths[:-1])
+    positions, depths = positions[change], depths[change]
+
+    covered = depths[:-1] > 0
+    return positions[:-1][covered], positions[1:][covered], depths[:-1][covered]
+
+def _map_jobs(func, jobs, n_jobs=None, executor=None):
+    """ return [func(job) for job in jobs], run in parallel if asked
+
+    executor may be any object with an order preserving map method, such as
+    a multiprocessing.Pool.  Otherwise n_jobs > 1 runs the jobs in a pool of
+    that many processes for the call, and n_jobs=-1 uses every cpu.
+    """
+    if executor is not None:
+        return list(executor.map(func, jobs))
+    if n_jobs is None or n_jobs == 1 or len(jobs) < 2:
+        return map(func, jobs)
+
+    import multiprocessing
+    processes = min(n_jobs, len(jobs)) if n_jobs > 0 else None
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(func, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def _rows_by_chrom(intervals):
+    """ return a dict of chrom: list of positions in intervals """
+    rows = {}
+    for i, x in enumerate(intervals):
+        rows.setdefault(x.chrom, []).append(i)
+    return rows
+
+def _coordinates(intervals, rows):
+    """ return the starts and ends of some intervals as arrays to send to a worker """
+    return (
+        np.array([intervals[i].start for i in rows], dtype=np.int64),
+        np.array([intervals[i].end for i in rows], dtype=np.int64)
+    )
+
+def _plain_intervals(chrom, coordinates):
+    """ rebuild intervals from _coordinates, with their position as value """
+    starts, ends = coordinates
+    return [
+        Interval(start, end, chrom=chrom, value=i)
+        for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()))
+    ]
+
+def _merge_job(args):
+    """ merge the intervals of one chromosome in a worker """
+    chrom, coordinates, merge_contiguous = args
+    merged = Interval.merge(_plain_intervals(chrom, coordinates), merge_contiguous)
+    return [(x.value, x.start, x.end) for x in merged]
+
+def _depth_job(args):
+    return _depth(*args)
+
+def _spanning_set_job(args):
+    """ find the spanning sets of a list of independent problems in a worker """
+    problems, solver = args
+    results = []
+    for chrom, targets, candidates, keys in problems:
+        sort_key = (lambda x, keys=keys: keys[x.value]) if keys is not None else None
+        mss = MinimalSpanningSet(
+            _plain_intervals(chrom, targets), _plain_intervals(chrom, candidates),
+            sort_key=sort_key, solver=solver
+        )
+        results.append((
+            [x.value for x in mss.chosen],
+            [x.value for x in mss.candidates],
+            [(x.value, x.start, x.end) for x in mss.remaining_targets]
+        ))
+    return results
+
+def _components(targets, target_rows, candidates, candidate_rows):
+    """ split the targets and candidates of one chromosome into groups that
+    share no bases, returning (target rows, candidate rows) for each group
+    with both, in order of position """
+    rows = list(target_rows) + list(candidate_rows)
+    is_target = np.arange(len(rows)) < len(target_rows)
+    intervals = [targets[i] for i in target_rows] + [candidates[i] for i in candidate_rows]
+    starts = np.array([x.start for x in intervals], dtype=np.int64)
+    ends = np.array([x.end for x in intervals], dtype=np.int64)
+
+    # sweep by start, a new group begins past the furthest end so far
+    order = np.argsort(starts, kind='mergesort')
+    reach = np.maximum.accumulate(ends[order])
+    bounds = np.flatnonzero(starts[order][1:] >= reach[:-1]) + 1
+
+    groups = []
+    for group in np.split(order, bounds) if len(order) else []:
+        group = np.sort(group)
+        in_targets = is_target[group]
+        if in_targets.any() and not in_targets.all():
+            groups.append((
+                [rows[i] for i in group[in_targets]],
+                [rows[i] for i in group[~in_targets]]
+            ))
+    return groups
+
+# the number of intervals to aim for in each spanning set job
+_SPANNING_SET_JOB_SIZE = 10000
+
+_LOCUS = re.compile(r'([^:]+):(\d+)-(\d+)(?::([+-]|-?1)?)?$')
+_LOCUS_LINES = re.compile(r'^([^:\n]+):(\d+)-(\d+)(?::([+-]|-?1)?)?$', re.M)
+_LOCUS_STRANDS = {'+': 1, '-': -1, '1': 1, '-1': -1, '': None, None: None}
+
+def _parse_loci(locs):
+    """ parse chr:start-end:strand strings into columns
+
+    Returns chroms, starts, ends and strands for the strings that parse and
+    the indices of those that do not.
+    """
+    locs = [x if isinstance(x, basestring) else '' for x in locs]
+
+    # parse everything with one findall, falling back to one match per
+    # string to find the bad rows if any line fails
+    text = '\n'.join(locs)
+    rows = _LOCUS_LINES.findall(text)
+    if len(rows) == len(locs) and text.count('\n') == len(locs) - 1:
+        bad = []
+    else:
+        matches = [_LOCUS.match(x) for x in locs]
+        bad = [i for i, m in enumerate(matches) if m is None]
+        rows = [m.groups('') for m in matches if m is not None]
+
+    chroms, starts, ends, strands = zip(*rows) if rows else ((), (), (), ())
+    return (
+        chroms,
+        np.array(starts, dtype=np.int64),
+        np.array(ends, dtype=np.int64),
+        [_LOCUS_STRANDS[x] for x in strands],
+        bad
+    )
+
+def _chrom_length(genome, chrom):
+    """ return the length of a chromosome of a Genome or pyfasta Fasta, or
+    None if there is no genome """
+    if genome is None:
+        return None
+    if isinstance(genome, Genome):
+        genome = genome.fasta
+    return len(genome[chrom])
+
+def _genome_lengths(genome):
+    """ return a dict of the chromosome lengths of a Genome or pyfasta Fasta """
+    if genome is None:
+        return {}
+    if isinstance(genome, Genome):
+        return genome.chrom_lengths()
+    return dict((chrom, len(genome[chrom])) for chrom in genome.keys())
+
+def _clamp(start, end, length=None):
+    """ clip start and end to 0 and length, keeping end >= start """
+    start = max(start, 0)
+    end = max(end, 0)
+    if length is not None:
+        start, end = min(start, length), min(end, length)
+    return start, max(start, end)
+
+def _keyed(intervals, source, chrom_key):
+    """ yield ((chrom key, start, source, n), interval) for heapq.merge,
+    raising if the intervals are not sorted """
+    last = None
+    for n, item in enumerate(intervals):
+        key = (chrom_key(item.chrom), item.start)
+        if last is not None and key < last:
+            raise Exception('source %s is not sorted: %s after %s:%s' % (
+                source, item, last[0], last[1]))
+        last = key
+        yield key + (source, n), item
+
+def _read_spill(fh, cls, genomes):
+    """ yield the intervals written to a spill file by _external_sort """
+    while True:
+        try:
+            chrom, start, end, strand, value, genome = cPickle.load(fh)
+        except EOFError:
+            return
+        yield cls(start, end, chrom=chrom, strand=strand, value=value, genome=genomes[genome])
+
+def _external_sort(intervals, cls, chrom_key, chunksize, tmpdir=None):
+    """ yield intervals sorted by chromosome and start, holding at most
+    chunksize in memory
+
+    Each chunk is sorted and spilled to a temporary file, and the files
+    are merged.  The genomes are kept in memory and the other attributes
+    pickled.
+    """
+    intervals = iter(intervals)
+    key = lambda x: (chrom_key(x.chrom), x.start)
+    files, genomes, genome_ids = [], [], {}
+    try:
+        while True:
+            chunk = list(islice(intervals, chunksize))
+            if not chunk:
+                break
+            chunk.sort(key=key)
+            fh = tempfile.TemporaryFile(dir=tmpdir)
+            for x in chunk:
+                if id(x.genome) not in genome_ids:
+                    genome_ids[id(x.genome)] = len(genomes)
+                    genomes.append(x.genome)
+                cPickle.dump((x.chrom, x.start, x.end, x.strand, x.value,
+                    genome_ids[id(x.genome)]), fh, 2)
+            fh.seek(0)
+            files.append(fh)
+        del chunk
+
+        streams = [
+            _keyed(_read_spill(fh, cls, genomes), i, chrom_key)
+            for i, fh in enumerate(files)
+        ]
+        for key, item in heapq.merge(*streams):
+            yield item
+    finally:
+        for fh in files:
+            fh.close()
+
+class _IntervalMethods(object):
+    """ The methods shared by Interval and CompactInterval """
+    __slots__ = ()
 
     def __init__(self, start, stop, genome=None, **kws):
         self.genome = genome
@@ -83,6 +558,9 @@ class Interval(BaseInterval):
         if not self.genome:
             raise Exception('Cannot retrieve sequence without a genome')
 
+        if isinstance(self.genome, Genome):
+            return self.genome.fetch(self.chrom, self.start, self.end, self.strand)
+
         return self.genome.sequence(dict(
             start = self.start,
             stop = self.end,
@@ -90,6 +568,12 @@ class Interval(BaseInterval):
             strand = self.strand
         ), one_based=False).upper()
 
+    def sequence_view(self):
+        """ Return a SequenceView of this interval, without copying the DNA """
+        if not isinstance(self.genome, Genome):
+            raise Exception('Cannot view sequence without a Genome')
+        return SequenceView(self.genome.view(self.chrom, self.start, self.end), self.strand)
+
     def __str__(self):
         """ Return a chr:start-stop:strand representation of the interval """
         return "%s:%s-%s:%s" % (self.chrom, self.start, self.end, self.strand if self.strand else '')
@@ -122,6 +606,23 @@ class Interval(BaseInterval):
             strand = None
         return cls(start, end, chrom=chrom, strand=strand, **kws)
 
+    @classmethod
+    def from_strings(cls, locs, arrays=False, **kws):
+        """ Create intervals from an iterable of chrx:start-end:strand strings
+
+        The strands accepted are as for from_string.  Returns a pair of the
+        intervals, or an IntervalArray if arrays is True, and a list of the
+        indices of any strings that could not be parsed.
+        """
+        chroms, starts, ends, strands, bad = _parse_loci(locs)
+        if arrays:
+            return IntervalArray(starts, ends, chrom=chroms, strand=strands,
+                genome=kws.get('genome')), bad
+        return [
+            cls(int(start), int(end), chrom=chrom, strand=strand, **kws)
+            for chrom, start, end, strand in zip(chroms, starts, ends, strands)
+        ], bad
+
     def distance(self, other):
         """ return the distance between two intervals """
         if self.chrom != other.chrom:   return float('Inf')
@@ -169,7 +670,7 @@ class Interval(BaseInterval):
         """ Return the interval containing the intersection of two intervals """
         if not self.overlaps(other):
             return None
-        return Interval(
+        return type(self)(
             max(self.start, other.start),
             min(self.end, other.end),
             chrom = self.chrom
@@ -177,7 +678,7 @@ class Interval(BaseInterval):
 
     def union(self, other, merge_contiguous=False):
         """ Return an interval containing the interval of two overlapping interval"""
-        test = Interval.is_contiguous if merge_contiguous else Interval.overlaps
+        test = _IntervalMethods.is_contiguous if merge_contiguous else _IntervalMethods.overlaps
         if not test(self, other):
             raise Exception('cannot get union of non overlapping intervals')
         return self.span(other)
@@ -197,7 +698,7 @@ class Interval(BaseInterval):
                 value=self.value, genome=self.genome)
         template.update(kws)
 
-        return Interval(start, end, **template)
+        return type(self)(start, end, **template)
 
 
     def __sub__(self, other):
@@ -233,62 +734,180 @@ class Interval(BaseInterval):
 
 
     @classmethod
-    def merge(cls, intervals, merge_contiguous=False, **kwargs):
+    @_timed('merge')
+    def merge(cls, intervals, merge_contiguous=False, n_jobs=None, executor=None, **kwargs):
         """ merge a list of intervals and return a list of intervals
 
         By default, the intervals must be overlapping to be merged.  If you
         want to merge contiguous intervals, set merge_contiguous to True.
+        Any kwargs are applied to the merged intervals, as for copy.
+
+        With n_jobs or an executor (see MinimalSpanningSet) each chromosome
+        is merged in a separate process.  Only the coordinates are sent to
+        the workers, and the result is the same as merging in this process.
         """
+        if n_jobs is not None or executor is not None:
+            intervals = list(intervals)
+            by_chrom = _rows_by_chrom(intervals)
+            chroms = sorted(by_chrom)
+            jobs = [
+                (chrom, _coordinates(intervals, by_chrom[chrom]), merge_contiguous)
+                for chrom in chroms
+            ]
+            return [
+                intervals[by_chrom[chrom][i]].copy(start=start, end=end, **kwargs)
+                for chrom, merged in zip(chroms, _map_jobs(_merge_job, jobs, n_jobs, executor))
+                for i, start, end in merged
+            ]
 
-        is_overlapping = cls.is_contiguous if merge_contiguous else cls.overlaps
-        intervals = sorted(intervals, key=lambda x: (x.chrom, x.end))
+        is_overlapping = _IntervalMethods.is_contiguous if merge_contiguous else _IntervalMethods.overlaps
 
-        if len(intervals) > 1:
-            done, todo = [intervals[0].copy(**kwargs)], intervals[1:]
-            while todo:
-                item = todo.pop(0).copy(**kwargs)
+        # sorted by end, an item can only merge with the tail of done, so
+        # each interval is pushed and popped at most once
+        done = []
+        for item in sorted(intervals, key=lambda x: (x.chrom, x.end)):
+            item = item.copy(**kwargs)
+            while done and is_overlapping(item, done[-1]):
+                item = done.pop().union(item, merge_contiguous=merge_contiguous)
+            done.append(item)
+        return done
 
-                while done and is_overlapping(item, done[-1]):
-                    item = done.pop().union(item, merge_contiguous=merge_contiguous)
-                done.append(item)
+    @classmethod
+    def imerge(cls, intervals, presorted=True, merge_contiguous=False, **kwargs):
+        """ merge an iterable of intervals, yielding the merged intervals
+
+        The input must be sorted by start within each chromosome, and each
+        chromosome must appear in one block, as in a sorted BED file.  Only
+        the interval being extended is held in memory.  If presorted is
+        False the input is sorted by (chrom, start) first.  merge_contiguous
+        and kwargs are as for merge.
+        """
+        if not presorted:
+            intervals = sorted(intervals, key=lambda x: (x.chrom, x.start))
+
+        current = None
+        finished = set()
+        for item in intervals:
+            if current is not None:
+                if item.chrom == current.chrom:
+                    if item.start < current.start:
+                        raise Exception('intervals are not sorted: %s after %s' % (item, current))
+                    if item.start < current.end or (merge_contiguous and item.start == current.end):
+                        if item.end > current.end:
+                            current.end = item.end
+                        continue
+                else:
+                    finished.add(current.chrom)
+                    if item.chrom in finished:
+                        raise Exception('intervals are not sorted: %s seen again' % item.chrom)
+                yield current
+            current = item.copy(**kwargs)
+
+        if current is not None:
+            yield current
+
+    @classmethod
+    def kmerge(cls, sources, presorted=True, merge_contiguous=False, chrom_order=None,
+            chunksize=1000000, tmpdir=None, **kwargs):
+        """ merge several sorted sources of intervals, yielding the merged intervals
+
+        Each source is an iterable of intervals or the name of a BED file,
+        sorted by chromosome and start.  The sources are combined lazily
+        with a k-way heap merge and merged as for imerge, so only one
+        interval per source is held in memory.  By default chromosomes are
+        expected in sorted order, as from sort -k1,1 -k2,2n; chrom_order
+        may give another order as a list of names.  A source out of order
+        raises an Exception.
+
+        If presorted is False the sources are sorted on disk instead, in
+        chunks of chunksize intervals spilled to temporary files in tmpdir.
+        merge_contiguous and kwargs are as for merge.
+        """
+        if chrom_order is None:
+            chrom_key = lambda chrom: chrom
         else:
-            done = intervals
-        return done
+            positions = dict((chrom, i) for i, chrom in enumerate(chrom_order))
+            def chrom_key(chrom):
+                if chrom not in positions:
+                    raise Exception('chromosome %s is not in chrom_order' % chrom)
+                return positions[chrom]
+
+        genome = kwargs.get('genome')
+        sources = [
+            (x for chunk in read_bed(source, genome=genome) for x in chunk)
+            if isinstance(source, basestring) else source
+            for source in sources
+        ]
+        if presorted:
+            streams = [_keyed(source, i, chrom_key) for i, source in enumerate(sources)]
+            intervals = (item for key, item in heapq.merge(*streams))
+        else:
+            intervals = _external_sort((x for source in sources for x in source),
+                cls, chrom_key, chunksize, tmpdir)
+        return cls.imerge(intervals, merge_contiguous=merge_contiguous, **kwargs)
 
     @classmethod
-    def coverage(cls, intervals):
-        if not intervals: return []
-        chrom = intervals[0].chrom
-        starts = [x.start for x in intervals]
-        ends = [x.end for x in intervals]
-        breaks = sorted(set(starts + ends))
+    @_timed('coverage')
+    def coverage(cls, intervals, arrays=False, n_jobs=None, executor=None):
+        """ return the depth of coverage of a list of intervals
+
+        Returns an interval for each run of constant, non-zero depth, with
+        the depth as its value, ordered by chromosome and start.  intervals
+        may span several chromosomes and may be an IntervalArray.  If arrays
+        is True a dict of chrom: (starts, ends, depths) arrays is returned.
+        n_jobs and executor run each chromosome in a separate process, as
+        for merge.
+        """
+        if not isinstance(intervals, IntervalArray):
+            intervals = IntervalArray.from_intervals(intervals)
+
+        chroms, jobs = [], []
+        for chrom, rows in intervals.chrom_rows():
+            chroms.append(chrom)
+            jobs.append((intervals.starts[rows], intervals.ends[rows]))
+        result = dict(zip(chroms, _map_jobs(_depth_job, jobs, n_jobs, executor)))
+
+        if arrays:
+            return result
 
         return [
-            cls(start, end, chrom=chrom,
-                value=1 + len([x for x in starts if x<= start]) - len([x for x in ends if x <= end])
-            )
-            for start, end in zip(breaks, breaks[1:])
+            cls(int(start), int(end), chrom=chrom, value=int(depth))
+            for chrom in sorted(result)
+            for start, end, depth in zip(*result[chrom])
         ]
 
-    def add_border(self, size=0, upstream=0, downstream=0):
-        """ return interval with some bases added to each end """
-        if not (size or upstream or downstream):
-            return self.copy()
+    def add_border(self, size=0, upstream=0, downstream=0, clamp=False):
+        """ return interval with some bases added to each end
 
+        If clamp is True the interval is kept within its chromosome, as
+        for clamp.
+        """
         if size and (upstream or downstream):
             raise Exception('please either size or upstream/downstream')
 
-        if size:
-            return self.copy(start=self.start-size, end = self.end+size)
+        start, end = self.start - size, self.end + size
+        if upstream or downstream:
+            if not self.strand:
+                raise Exception('Cannot add upstrea/downstream to strandless interval')
+            if self.strand == 1:
+                start, end = self.start - upstream, self.end + downstream
+            else:
+                start, end = self.start - downstream, self.end + upstream
 
-        if not self.strand:
-            raise Exception('Cannot add upstrea/downstream to strandless interval')
+        if clamp:
+            start, end = _clamp(start, end, _chrom_length(self.genome, self.chrom))
+        return self.copy(start=start, end=end)
 
-        if self.strand == 1:
-            return self.copy(start=self.start - upstream, end = self.end + downstream)
+    def clamp(self, length=None):
+        """ return this interval clipped to its chromosome, from 0 to length
 
-        else:
-            return self.copy(start=self.start - downstream, end = self.end + upstream)
+        By default length is taken from the genome.  Without one only
+        negative coordinates are clipped.
+        """
+        if length is None:
+            length = _chrom_length(self.genome, self.chrom)
+        start, end = _clamp(self.start, self.end, length)
+        return self.copy(start=start, end=end)
 
     def truncate(self, size):
         """ truncate this interval to size, respecting the orientation """
@@ -300,23 +919,1802 @@ class Interval(BaseInterval):
             return self.copy(start=max(self.end-size, self.start))
 
 
-class Genome(object):
+class Interval(_IntervalMethods, BaseInterval):
+    """ A genomic interval """
+
+class CompactInterval(_IntervalMethods, BaseInterval):
+    """ A genomic interval without an instance dict
+
+    It has all the methods of Interval, but only the bx interval fields and
+    genome can be set, and chromosome names are interned so intervals share
+    them.  Use it to hold millions of intervals in memory.
+    """
+    __slots__ = ('genome',)
+
+    def __init__(self, start, stop, genome=None, **kws):
+        self.genome = genome
+        if type(kws.get('chrom')) is str:
+            kws['chrom'] = intern(kws['chrom'])
+        if 'strand' in kws:
+            kws['strand'] = _convert_strand(kws['strand'])
+        BaseInterval.__init__(self, start, stop, **kws)
+
+    def __reduce__(self):
+        # the bx pickle support does not know about the genome slot
+        return _unpickle_compact, (type(self), self.start, self.end, self.chrom,
+            self.strand, self.value, self.genome)
+
+def _unpickle_compact(cls, start, end, chrom, strand, value, genome):
+    return cls(start, end, genome=genome, chrom=chrom, strand=strand, value=value)
+
+def _encode_chroms(chrom, n, names=()):
+    """ return a (names, codes) pair encoding chrom for n rows
+
+    chrom may be a single name or a sequence of names.  Codes index into
+    names, which is extended with any names not already present.
+    """
+    names = list(names)
+    lookup = dict((name, code) for code, name in enumerate(names))
+    if chrom is None or isinstance(chrom, basestring):
+        code = lookup.get(chrom)
+        if code is None:
+            code = len(names)
+            names.append(chrom)
+        return tuple(names), np.repeat(np.int32(code), n)
+
+    codes = np.empty(n, dtype=np.int32)
+    for i, name in enumerate(chrom):
+        code = lookup.get(name)
+        if code is None:
+            code = lookup[name] = len(names)
+            names.append(name)
+        codes[i] = code
+    return tuple(names), codes
+
+def _encode_strands(strand, n):
+    """ return an int8 array of +1/-1/0 strands for n rows """
+    if strand is None or isinstance(strand, (basestring, int, long)):
+        return np.repeat(np.int8(_convert_strand(strand) or 0), n)
+    return np.array([_convert_strand(x) or 0 for x in strand], dtype=np.int8)
+
+class IntervalArray(object):
+    """ A columnar array of intervals
+
+    Chromosomes are stored as integer codes into the `chroms` tuple, and
+    start, end and strand are stored in numpy arrays (strand is 1, -1 or 0
+    for no strand).  The interval methods are vectorized: they take either
+    a single Interval, which is broadcast, or an IntervalArray of the same
+    length and return boolean, integer or IntervalArray results.
+    """
+
+    def __init__(self, starts, ends, chrom=None, strand=None, genome=None):
+        """ Create an array from starts and ends.
+
+        chrom and strand may be a single value or a sequence with one entry
+        per interval.
+        """
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        n = len(self.starts)
+        if len(self.ends) != n:
+            raise Exception('starts and ends must be the same length')
+        self.chroms, self.chrom_codes = _encode_chroms(chrom, n)
+        self.strands = _encode_strands(strand, n)
+        self.genome = genome
+
+    @classmethod
+    def from_columns(cls, chroms, chrom_codes, starts, ends, strands, genome=None):
+        """ Create an array directly from already encoded columns """
+        self = cls.__new__(cls)
+        self.chroms = tuple(chroms)
+        self.chrom_codes = np.asarray(chrom_codes, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.strands = np.asarray(strands, dtype=np.int8)
+        self.genome = genome
+        return self
+
+    @classmethod
+    def from_intervals(cls, intervals, genome=None):
+        """ Create an array from a list of intervals """
+        intervals = list(intervals)
+        if genome is None and intervals:
+            genome = intervals[0].genome
+        return cls(
+            [x.start for x in intervals],
+            [x.end for x in intervals],
+            chrom=[x.chrom for x in intervals],
+            strand=[x.strand for x in intervals],
+            genome=genome
+        )
+
+    @classmethod
+    def concatenate(cls, arrays, genome=None):
+        """ Join a list of arrays into one """
+        arrays = list(arrays)
+        names, lookup = [], {}
+        codes = []
+        for array in arrays:
+            mapping = np.zeros(len(array.chroms), dtype=np.int32)
+            for i, name in enumerate(array.chroms):
+                if name not in lookup:
+                    lookup[name] = len(names)
+                    names.append(name)
+                mapping[i] = lookup[name]
+            codes.append(mapping[array.chrom_codes])
+        if genome is None and arrays:
+            genome = arrays[0].genome
+        join = lambda name: np.concatenate([getattr(x, name) for x in arrays]) if arrays else ()
+        return cls.from_columns(names, np.concatenate(codes) if arrays else (),
+            join('starts'), join('ends'), join('strands'), genome=genome)
+
+    def to_intervals(self):
+        """ Return a list of Interval objects """
+        return list(self)
+
+    @property
+    def sequences(self):
+        """ Return a list of the DNA of each interval, see Genome.sequences """
+        if not self.genome:
+            raise Exception('Cannot retrieve sequence without a genome')
+        if isinstance(self.genome, Genome):
+            return self.genome.sequences(self)
+        return _fetch_sequences(self.genome, self)
+
+    def _replace(self, starts=None, ends=None, strands=None):
+        """ Return a copy sharing the chromosome columns with new coordinates """
+        return self.from_columns(
+            self.chroms, self.chrom_codes,
+            self.starts if starts is None else starts,
+            self.ends if ends is None else ends,
+            self.strands if strands is None else strands,
+            genome=self.genome
+        )
+
+    def __len__(self):
+        """ Return the number of intervals """
+        return len(self.starts)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        """ Return an Interval for an integer key, otherwise an IntervalArray """
+        if isinstance(key, (int, long, np.integer)):
+            strand = int(self.strands[key])
+            return Interval(
+                int(self.starts[key]), int(self.ends[key]),
+                chrom=self.chroms[self.chrom_codes[key]],
+                strand=strand or None,
+                genome=self.genome
+            )
+        return self.from_columns(
+            self.chroms, self.chrom_codes[key], self.starts[key],
+            self.ends[key], self.strands[key], genome=self.genome
+        )
+
+    def __repr__(self):
+        return 'IntervalArray(%s)' % len(self)
+
+    def lengths(self):
+        """ Return an array of interval lengths """
+        return self.ends - self.starts
+
+    def chrom_rows(self):
+        """ Yield (chrom, rows) for each chromosome present, where rows is an
+        array of the row numbers on that chromosome """
+        order = np.argsort(self.chrom_codes, kind='mergesort')
+        bounds = np.flatnonzero(np.diff(self.chrom_codes[order])) + 1
+        for rows in np.split(order, bounds) if len(order) else []:
+            yield self.chroms[self.chrom_codes[rows[0]]], rows
+
+    def _columns(self, other):
+        """ Return chrom codes, starts and ends of other in our code space
+
+        other may be an Interval, which is returned as scalars, or an
+        IntervalArray.  Chromosomes we do not know are given code -1.
+        """
+        lookup = dict((name, code) for code, name in enumerate(self.chroms))
+        if isinstance(other, IntervalArray):
+            if other.chroms == self.chroms:
+                codes = other.chrom_codes
+            else:
+                remap = np.array([lookup.get(x, -1) for x in other.chroms], dtype=np.int32)
+                codes = remap[other.chrom_codes]
+            return codes, other.starts, other.ends
+        return lookup.get(other.chrom, -1), other.start, other.end
+
+    def distance(self, other):
+        """ return the distances to other, inf on different chromosomes """
+        codes, starts, ends = self._columns(other)
+        gap = np.maximum(np.maximum(self.starts - ends, starts - self.ends), 0)
+        return np.where(self.chrom_codes == codes, gap, np.inf)
+
+    def overlaps(self, other):
+        """ Return True where the intervals share at least one base """
+        codes, starts, ends = self._columns(other)
+        return (
+            (self.chrom_codes == codes)
+            & (self.starts < ends)
+            & (self.ends > starts)
+        )
+
+    def is_contiguous(self, other):
+        """ Return True where the intervals are overlapping or contiguous """
+        codes, starts, ends = self._columns(other)
+        return (
+            (self.chrom_codes == codes)
+            & (self.starts <= ends)
+            & (self.ends >= starts)
+        )
+
+    def contains(self, other):
+        """ Return True where these intervals contain other, see Interval.__contains__ """
+        codes, starts, ends = self._columns(other)
+        return (self.starts <= starts) & (self.ends >= ends)
+
+    def intersection(self, other):
+        """ Return the intersections with other
+
+        Rows that do not overlap are returned as empty intervals, use
+        overlaps to mask them out.
+        """
+        codes, starts, ends = self._columns(other)
+        new_starts = np.maximum(self.starts, starts)
+        new_ends = np.minimum(self.ends, ends)
+        empty = ~self.overlaps(other)
+        new_ends[empty] = new_starts[empty]
+        return self._replace(new_starts, new_ends, np.zeros(len(self), dtype=np.int8))
+
+    def span(self, other):
+        """ Return intervals spanning these and other """
+        codes, starts, ends = self._columns(other)
+        if not np.all(self.chrom_codes == codes):
+            raise Exception('cannot get span over two chromosomes')
+        return self._replace(np.minimum(self.starts, starts), np.maximum(self.ends, ends))
+
+    def add_border(self, size=0, upstream=0, downstream=0, clamp=False, lengths=None):
+        """ return intervals with some bases added to each end, kept within
+        their chromosomes if clamp is True, see clamp """
+        if size and (upstream or downstream):
+            raise Exception('please either size or upstream/downstream')
+
+        if size or not (upstream or downstream):
+            result = self._replace(self.starts - size, self.ends + size)
+        elif not np.all(self.strands):
+            raise Exception('Cannot add upstrea/downstream to strandless interval')
+        else:
+            forward = self.strands > 0
+            result = self._replace(
+                self.starts - np.where(forward, upstream, downstream),
+                self.ends + np.where(forward, downstream, upstream)
+            )
+        return result.clamp(lengths) if clamp else result
+
+    def chrom_lengths(self, lengths=None):
+        """ return an array of the length of the chromosome of each row
+
+        lengths is a dict of chromosome lengths, by default those of the
+        genome.  Chromosomes without a length are given the largest int64.
+        """
+        if lengths is None:
+            lengths = _genome_lengths(self.genome)
+        unknown = np.iinfo(np.int64).max
+        by_code = np.array([lengths.get(x, unknown) for x in self.chroms], dtype=np.int64)
+        return by_code[self.chrom_codes]
+
+    def clamp(self, lengths=None):
+        """ return intervals clipped to their chromosomes
+
+        lengths is as for chrom_lengths.  Intervals past the end of their
+        chromosome become empty intervals at the end.
+        """
+        limits = self.chrom_lengths(lengths)
+        starts = np.minimum(np.maximum(self.starts, 0), limits)
+        ends = np.minimum(np.maximum(self.ends, starts), limits)
+        return self._replace(starts, ends)
+
+    def slop(self, size=0, upstream=0, downstream=0, lengths=None):
+        """ return intervals extended as for add_border and clamped to
+        their chromosomes """
+        return self.add_border(size, upstream, downstream, clamp=True, lengths=lengths)
+
+    def flank(self, size, upstream=True, clamp=True, lengths=None):
+        """ return the size bases upstream of each interval, or downstream
+        if upstream is False, on its strand
+
+        Unstranded intervals are treated as on the forward strand.  The
+        flanks are clamped to the chromosomes unless clamp is False.
+        """
+        left = (self.strands >= 0) == upstream
+        starts = np.where(left, self.starts - size, self.ends)
+        result = self._replace(starts, starts + size)
+        return result.clamp(lengths) if clamp else result
+
+    def shift(self, offset, strand_aware=False, clamp=False, lengths=None):
+        """ return intervals moved offset bases to the right, or downstream
+        on their strand if strand_aware is True """
+        offsets = offset
+        if strand_aware:
+            offsets = np.where(self.strands < 0, -offset, offset)
+        result = self._replace(self.starts + offsets, self.ends + offsets)
+        return result.clamp(lengths) if clamp else result
+
+    def resize(self, size, anchor='start', clamp=False, lengths=None):
+        """ return intervals of size bases, keeping the start, end or center
+
+        The start and end are on the strand, so anchor='start' keeps the 5'
+        end.  Unstranded intervals are treated as on the forward strand.
+        """
+        reverse = self.strands < 0
+        if anchor == 'center':
+            starts = (self.starts + self.ends) // 2 - size // 2
+        elif anchor in ('start', 'end'):
+            from_end = reverse if anchor == 'start' else ~reverse
+            starts = np.where(from_end, self.ends - size, self.starts)
+        else:
+            raise Exception('unknown anchor %s' % anchor)
+        result = self._replace(starts, starts + size)
+        return result.clamp(lengths) if clamp else result
+
+    def truncate(self, size):
+        """ truncate intervals to size, respecting the orientation """
+        if not np.all(self.strands):
+            raise Exception('cannot truncate unstranded interval')
+        forward = self.strands > 0
+        return self._replace(
+            np.where(forward, self.starts, np.maximum(self.ends - size, self.starts)),
+            np.where(forward, np.minimum(self.starts + size, self.ends), self.ends)
+        )
+
+
+def _merge_runs(starts, ends):
+    """ sort intervals and join those that overlap or touch, dropping empty
+    ones, returning the (starts, ends) arrays """
+    keep = ends > starts
+    order = np.argsort(starts[keep], kind='mergesort')
+    starts, ends = starts[keep][order], ends[keep][order]
+    if not len(starts):
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    first = np.flatnonzero(np.append(True, starts[1:] > reach[:-1]))
+    return starts[first], np.append(reach[first[1:] - 1], reach[-1])
+
+def _sweep(a, b, op):
+    """ combine two sorted, merged (starts, ends) pairs with a boolean op on
+    membership of each, sweeping their boundaries in order """
+    bounds = [np.column_stack(x).ravel() for x in (a, b)]
+    positions = np.concatenate(bounds)
+    # +1 entering and -1 leaving an interval of each set
+    steps = [np.tile(np.array([1, -1], dtype=np.int8), len(x) // 2) for x in bounds]
+    in_a = np.concatenate((steps[0], np.zeros(len(bounds[1]), dtype=np.int8)))
+    in_b = np.concatenate((np.zeros(len(bounds[0]), dtype=np.int8), steps[1]))
+
+    order = np.argsort(positions, kind='mergesort')
+    positions = positions[order]
+    in_a, in_b = np.cumsum(in_a[order]), np.cumsum(in_b[order])
+
+    # membership after the last boundary at each position
+    last = np.append(positions[1:] != positions[:-1], True)
+    positions = positions[last]
+    inside = op(in_a[last] > 0, in_b[last] > 0)
+    before = np.append(False, inside[:-1])
+    return positions[inside & ~before], positions[~inside & before]
+
+class IntervalSet(object):
+    """ A set of bases, held as sorted and merged intervals per chromosome
+
+    Overlapping and contiguous intervals are joined.  The operators |, &, -
+    and ^ give the union, intersection, difference and symmetric difference
+    of two sets, each computed with one ordered sweep over the boundaries
+    of both sets.  Strands and values are not kept.
+    """
+
+    def __init__(self, intervals=(), genome=None):
+        """ Create a set from a list of intervals or an IntervalArray """
+        if not isinstance(intervals, IntervalArray):
+            intervals = IntervalArray.from_intervals(intervals)
+        self.genome = genome or intervals.genome
+        self.starts = {}
+        self.ends = {}
+        for chrom, rows in intervals.chrom_rows():
+            starts, ends = _merge_runs(intervals.starts[rows], intervals.ends[rows])
+            if len(starts):
+                self.starts[chrom], self.ends[chrom] = starts, ends
+
+    @classmethod
+    def _from_runs(cls, runs, genome=None):
+        self = cls(genome=genome)
+        for chrom, (starts, ends) in runs.items():
+            if len(starts):
+                self.starts[chrom], self.ends[chrom] = starts, ends
+        return self
+
+    def __len__(self):
+        """ Return the number of merged intervals """
+        return sum(len(x) for x in self.starts.values())
+
+    def __iter__(self):
+        """ Yield the intervals ordered by chromosome and start """
+        for chrom in sorted(self.starts):
+            for start, end in zip(self.starts[chrom], self.ends[chrom]):
+                yield Interval(int(start), int(end), chrom=chrom, genome=self.genome)
+
+    def __repr__(self):
+        return 'IntervalSet(%s)' % len(self)
+
+    def total_length(self):
+        """ Return the number of bases in the set """
+        return int(sum((self.ends[x] - self.starts[x]).sum() for x in self.starts))
+
+    def to_array(self):
+        """ Return the intervals as an IntervalArray """
+        chroms = sorted(self.starts)
+        return IntervalArray.from_columns(
+            chroms,
+            np.repeat(np.arange(len(chroms), dtype=np.int32), [len(self.starts[x]) for x in chroms]),
+            np.concatenate([self.starts[x] for x in chroms] or [[]]),
+            np.concatenate([self.ends[x] for x in chroms] or [[]]),
+            np.zeros(len(self), dtype=np.int8),
+            genome=self.genome
+        )
+
+    def _combine(self, other, op, chroms):
+        empty = np.zeros(0, dtype=np.int64)
+        runs = {}
+        for chrom in chroms:
+            a = (self.starts.get(chrom, empty), self.ends.get(chrom, empty))
+            b = (other.starts.get(chrom, empty), other.ends.get(chrom, empty))
+            runs[chrom] = _sweep(a, b, op)
+        return self._from_runs(runs, self.genome)
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or, set(self.starts) | set(other.starts))
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and, set(self.starts) & set(other.starts))
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b, self.starts)
+
+    def __xor__(self, other):
+        return self._combine(other, np.logical_xor, set(self.starts) | set(other.starts))
+
+    def complement(self, genome=None):
+        """ Return the bases of the genome not in this set
+
+        genome is a Genome, pyfasta Fasta or a dict of chromosome lengths, and
+        defaults to the genome of the set.
+        """
+        if genome is None:
+            genome = self.genome
+        # a Fasta is a dict too, so tell them apart by the sequence method
+        if hasattr(genome, 'sequence'):
+            lengths = _genome_lengths(genome)
+        else:
+            lengths = genome or {}
+        whole = self._from_runs(dict(
+            (chrom, (np.zeros(1, dtype=np.int64), np.array([length], dtype=np.int64)))
+            for chrom, length in lengths.items()
+        ))
+        result = whole - self
+        result.genome = self.genome
+        return result
+
+class _NearestTable(object):
+    """ the intervals of one chromosome (and strand) sorted by start and by end """
+    __slots__ = ('starts', 'start_ends', 'reach', 'max_ends', 'level', 'by_start',
+        'ends', 'by_end')
+
+    def __init__(self, starts, ends, rows):
+        order = np.argsort(starts, kind='mergesort')
+        self.starts = starts[order]
+        self.start_ends = ends[order]
+        # the furthest end of any interval starting before each one
+        self.reach = np.maximum.accumulate(self.start_ends)
+        self.max_ends, self.level = _augment(self.starts, self.start_ends)
+        self.by_start = rows[order]
+        order = np.argsort(ends, kind='mergesort')
+        self.ends = ends[order]
+        self.by_end = rows[order]
+
+def _augment(starts, ends):
+    """ return the max end under each node of the implicit interval tree over
+    intervals sorted by start, and the level of its root
+
+    This is the layout of cgranges: node i is at the level of its lowest
+    unset bit, so the leaves are the even positions, and its subtrees are
+    the positions within 2**level either side.
+    """
+    n = len(starts)
+    max_ends = np.array(ends, dtype=np.int64)
+    if n == 0:
+        return max_ends, -1
+
+    last_i = (n - 1) & ~1
+    last = max_ends[last_i]
+    k = 1
+    while 1 << k <= n:
+        x = 1 << (k - 1)
+        nodes = np.arange((x << 1) - 1, n, x << 2)
+        if len(nodes):
+            right = nodes + x
+            right_max = np.where(right < n, max_ends[np.minimum(right, n - 1)], last)
+            max_ends[nodes] = np.maximum(np.maximum(ends[nodes], max_ends[nodes - x]), right_max)
+        # track the max end of the subtree holding the last position
+        last_i = last_i - x if (last_i >> k) & 1 else last_i + x
+        if last_i < n and max_ends[last_i] > last:
+            last = max_ends[last_i]
+        k += 1
+    return max_ends, k - 1
+
+def _tree_overlaps(starts, ends, max_ends, level, start, end, limit=None):
+    """ return the positions in start order of the intervals overlapping
+    start-end, searching the implicit tree from _augment, stopping after
+    limit if given """
+    n = len(starts)
+    found = []
+    stack = [(level, (1 << level) - 1, False)] if level >= 0 else []
+    while stack:
+        k, x, visited = stack.pop()
+        if k <= 3:
+            # small subtrees are scanned
+            lo = x >> k << k
+            hi = min(lo + (1 << (k + 1)) - 1, n)
+            hits = np.flatnonzero((starts[lo:hi] < end) & (ends[lo:hi] > start))
+            found.extend((hits + lo).tolist())
+            if limit is not None and len(found) >= limit:
+                return found[:limit]
+        elif not visited:
+            stack.append((k, x, True))
+            left = x - (1 << (k - 1))
+            if left >= n or max_ends[left] > start:
+                stack.append((k - 1, left, False))
+        elif x < n and starts[x] < end:
+            if ends[x] > start:
+                found.append(x)
+                if limit is not None and len(found) >= limit:
+                    return found
+            stack.append((k - 1, x + (1 << (k - 1)), False))
+    return found
+
+class _OverlapTree(object):
+    """ the intervals sorted by chromosome and start, with an implicit
+    augmented tree for each chromosome, see _augment """
+
+    COLUMNS = ('starts', 'ends', 'max_ends', 'rows')
+
+    def __init__(self, spans, starts, ends, max_ends, rows):
+        # spans is a dict of chrom: (lo, hi, level) giving its rows and tree
+        self.spans = spans
+        self.starts = starts
+        self.ends = ends
+        self.max_ends = max_ends
+        self.rows = rows
+
+    @classmethod
+    def build(cls, array):
+        rows = np.lexsort((array.starts, array.chrom_codes))
+        starts, ends = array.starts[rows], array.ends[rows]
+        max_ends = np.empty(len(rows), dtype=np.int64)
+        spans = {}
+        codes = array.chrom_codes[rows]
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(rows)]))
+        for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            if lo < hi:
+                max_ends[lo:hi], level = _augment(starts[lo:hi], ends[lo:hi])
+                spans[array.chroms[codes[lo]]] = (lo, hi, level)
+        return cls(spans, starts, ends, max_ends, rows)
+
+    def overlapping(self, chrom, start, end):
+        """ return the rows overlapping start-end on chrom, in start order """
+        if chrom not in self.spans:
+            return np.zeros(0, dtype=np.int64)
+        lo, hi, level = self.spans[chrom]
+        found = _tree_overlaps(self.starts[lo:hi], self.ends[lo:hi],
+            self.max_ends[lo:hi], level, start, end)
+        return self.rows[lo:hi][found]
+
+class IntervalIndex(object):
+    """ An index of intervals for overlap and nearest neighbour queries
+
+    Each chromosome keeps its intervals sorted by start and by end, so the
+    closest intervals to a query are found by bisection and a walk outwards
+    in O(log n + k).  Distances are as for Interval.distance, so overlapping
+    and contiguous intervals are at distance zero.  Overlaps are found with
+    an implicit augmented interval tree, as in cgranges.
+
+    An index can be saved to a directory of numpy files and loaded memory
+    mapped, so it is ready to query at once and its pages are shared by
+    every process using it.
+    """
+
+    def __init__(self, intervals):
+        """ Index a list of intervals, an IntervalArray, or an iterable of
+        lists or IntervalArrays such as the chunks of read_bed
+
+        Chunks are turned into arrays one at a time, so the intervals are
+        never all held as Python objects, and queries return intervals
+        made from the array.
+        """
+        if not isinstance(intervals, IntervalArray):
+            items = iter(intervals)
+            first = next(items, None)
+            if isinstance(first, (list, IntervalArray)):
+                intervals = IntervalArray.concatenate(
+                    x if isinstance(x, IntervalArray) else IntervalArray.from_intervals(x)
+                    for x in chain([first], items)
+                )
+            else:
+                intervals = [] if first is None else [first] + list(items)
+
+        if isinstance(intervals, IntervalArray):
+            self.intervals = None
+            self.array = intervals
+        else:
+            self.intervals = intervals
+            self.array = IntervalArray.from_intervals(self.intervals)
+        self._tables = {}
+        self._tree = None
+
+    def __len__(self):
+        return len(self.array)
+
+    def _get_tree(self):
+        if self._tree is None:
+            self._tree = _OverlapTree.build(self.array)
+        return self._tree
+
+    def overlapping_rows(self, chrom, start, end):
+        """ return an array of the rows overlapping start-end on chrom, in
+        order of start """
+        return self._get_tree().overlapping(chrom, start, end)
+
+    def overlapping(self, query):
+        """ return a list of the intervals overlapping query, in order of start """
+        return [
+            self._interval(row)
+            for row in self.overlapping_rows(query.chrom, query.start, query.end).tolist()
+        ]
+
+    def save(self, dirname):
+        """ write the index to a directory of .npy files, see load """
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tree = self._get_tree()
+        for name in ('chrom_codes', 'starts', 'ends', 'strands'):
+            np.save(os.path.join(dirname, name + '.npy'), getattr(self.array, name))
+        for name in _OverlapTree.COLUMNS:
+            np.save(os.path.join(dirname, 'tree_' + name + '.npy'), getattr(tree, name))
+        with open(os.path.join(dirname, 'index.pickle'), 'wb') as fh:
+            cPickle.dump(dict(chroms=self.array.chroms, spans=tree.spans), fh, 2)
+
+    @classmethod
+    def load(cls, dirname, genome=None, mmap=True):
+        """ load an index written by save, memory mapping the arrays unless
+        mmap is False.  Intervals are returned on genome. """
+        mmap_mode = 'r' if mmap else None
+        load = lambda name: np.load(os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(dirname, 'index.pickle'), 'rb') as fh:
+            meta = cPickle.load(fh)
+
+        self = cls.__new__(cls)
+        self.intervals = None
+        self.array = IntervalArray.from_columns(meta['chroms'], load('chrom_codes'),
+            load('starts'), load('ends'), load('strands'), genome=genome)
+        self._tables = {}
+        self._tree = _OverlapTree(meta['spans'],
+            *[load('tree_' + name) for name in _OverlapTree.COLUMNS])
+        return self
+
+    def _get_tables(self, strand_aware):
+        """ return the tables keyed by chrom, or by (chrom, strand) """
+        tables = self._tables.get(strand_aware)
+        if tables is None:
+            tables = self._tables[strand_aware] = {}
+            arr = self.array
+            for chrom, rows in arr.chrom_rows():
+                if strand_aware:
+                    for strand in np.unique(arr.strands[rows]):
+                        sub = rows[arr.strands[rows] == strand]
+                        tables[chrom, strand] = _NearestTable(arr.starts[sub], arr.ends[sub], sub)
+                else:
+                    tables[chrom] = _NearestTable(arr.starts[rows], arr.ends[rows], rows)
+        return tables
+
+    def _interval(self, row):
+        if self.intervals is not None:
+            return self.intervals[row]
+        return self.array[row]
+
+    def _closest_rows(self, table, start, end, k, max_distance):
+        """ return up to k (row, distance) pairs, nearest first """
+        # overlapping or contiguous, in start order, from the interval tree
+        # with the query widened by one base either side
+        found = _tree_overlaps(table.starts, table.start_ends, table.max_ends,
+            table.level, start - 1, end + 1, k)
+        hits = [(table.by_start[i], 0) for i in found]
+        right = np.searchsorted(table.starts, end, 'right')
+
+        # then walk out to the left and right, preferring left on ties
+        left = np.searchsorted(table.ends, start, 'left') - 1
+        while len(hits) < k:
+            left_distance = start - table.ends[left] if left >= 0 else None
+            right_distance = table.starts[right] - end if right < len(table.starts) else None
+            if left_distance is None and right_distance is None:
+                break
+            if right_distance is None or (left_distance is not None and left_distance <= right_distance):
+                hit = (table.by_end[left], left_distance)
+                left -= 1
+            else:
+                hit = (table.by_start[right], right_distance)
+                right += 1
+            if max_distance is not None and hit[1] > max_distance:
+                break
+            hits.append(hit)
+        return [(int(row), int(distance)) for row, distance in hits]
+
+    def _table(self, query, strand_aware):
+        if strand_aware:
+            return self._get_tables(True).get((query.chrom, query.strand or 0))
+        return self._get_tables(False).get(query.chrom)
+
+    def closest(self, query, k=1, strand_aware=False, max_distance=None):
+        """ return a list of up to k (interval, distance) pairs closest to query
+
+        If strand_aware only intervals on the strand of the query are
+        considered.  Intervals further than max_distance are not returned.
+        """
+        table = self._table(query, strand_aware)
+        if table is None:
+            return []
+        return [
+            (self._interval(row), distance)
+            for row, distance in self._closest_rows(table, query.start, query.end, k, max_distance)
+        ]
+
+    def closest_many(self, queries, k=1, strand_aware=False, max_distance=None):
+        """ find the closest intervals for a list of queries or an IntervalArray
+
+        Returns (rows, distances) arrays of shape (len(queries), k) giving
+        the indexed row numbers and distances, nearest first, padded with -1
+        and inf.  k=1 is answered with vectorized searches.
+        """
+        if not isinstance(queries, IntervalArray):
+            queries = IntervalArray.from_intervals(queries)
+        rows = np.empty((len(queries), k), dtype=np.int64)
+        rows.fill(-1)
+        distances = np.empty((len(queries), k))
+        distances.fill(np.inf)
+
+        for chrom, query_rows in queries.chrom_rows():
+            groups = [(chrom, query_rows)]
+            if strand_aware:
+                strands = queries.strands[query_rows]
+                groups = [((chrom, x), query_rows[strands == x]) for x in np.unique(strands)]
+            for key, query_rows in groups:
+                table = self._get_tables(strand_aware).get(key)
+                if table is None:
+                    continue
+                starts, ends = queries.starts[query_rows], queries.ends[query_rows]
+                if k == 1:
+                    found = self._closest_one(table, starts, ends, max_distance)
+                    rows[query_rows, 0], distances[query_rows, 0] = found
+                    continue
+                for row, start, end in zip(query_rows, starts, ends):
+                    hits = self._closest_rows(table, start, end, k, max_distance)
+                    for j, (hit, distance) in enumerate(hits):
+                        rows[row, j], distances[row, j] = hit, distance
+        return rows, distances
+
+    @staticmethod
+    def _closest_one(table, starts, ends, max_distance):
+        """ vectorized closest_rows for k=1 """
+        n = len(table.starts)
+        right = np.searchsorted(table.starts, ends, 'right')
+        first = np.searchsorted(table.reach, starts, 'left')
+        left = np.searchsorted(table.ends, starts, 'left') - 1
+
+        left_distance = np.where(left >= 0, starts - table.ends[np.maximum(left, 0)], np.inf)
+        right_distance = np.where(right < n, table.starts[np.minimum(right, n - 1)] - ends, np.inf)
+        use_left = left_distance <= right_distance
+        rows = np.where(use_left, table.by_end[np.maximum(left, 0)],
+            table.by_start[np.minimum(right, n - 1)])
+        distances = np.minimum(left_distance, right_distance)
+
+        zero = first < right
+        rows = np.where(zero, table.by_start[np.minimum(first, n - 1)], rows)
+        distances[zero] = 0
+
+        missing = np.isinf(distances)
+        if max_distance is not None:
+            missing |= distances > max_distance
+        rows[missing] = -1
+        distances[missing] = np.inf
+        return rows, distances
+
+class SequenceView(object):
+    """ The DNA of a region as a view into the mmapped genome
+
+    data is a uint8 numpy array sharing memory with the flat file, on the
+    forward strand and in the case of the fasta.  Nothing is upper cased or
+    complemented until the bases or sequence are asked for.
+    """
+    __slots__ = ('data', 'strand')
+
+    def __init__(self, data, strand=None):
+        self.data = data
+        self.strand = strand
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return self.bases().tostring()
+
+    @property
+    def sequence(self):
+        """ Return the DNA as a string, as Interval.sequence """
+        return str(self).decode()
+
+    def bases(self):
+        """ Return a new uint8 array of the upper case bases on the strand """
+        if self.strand == -1:
+            return _COMPLEMENT_CODES[self.data[::-1]]
+        return _UPPER_CODES[self.data]
+
+    def count(self, base):
+        """ Return the number of times base occurs on the strand """
+        if self.strand == -1:
+            base = chr(_COMPLEMENT_CODES[ord(base)])
+        return int(np.count_nonzero(
+            (self.data == ord(base.upper())) | (self.data == ord(base.lower()))))
+
+class SequenceCache(object):
+    """ A least recently used cache of sequences with a budget in bytes
+
+    Entries are keyed by (chrom, start, end, strand) and hold the sequence
+    as returned by Interval.sequence, counting one byte per base.  A lookup
+    that misses an exact key is served from any cached region enclosing it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        # per chromosome, the cached keys sorted by start and their longest span
+        self.starts = {}
+        self.keys = {}
+        self.max_length = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """ return a dict of hits, misses, entries and bytes """
+        return dict(hits=self.hits, misses=self.misses,
+            entries=len(self.entries), bytes=self.bytes)
+
+    def clear(self):
+        """ empty the cache, keeping the statistics """
+        self.entries.clear()
+        self.starts.clear()
+        self.keys.clear()
+        self.max_length.clear()
+        self.bytes = 0
+
+    def get(self, chrom, start, end, strand=None):
+        """ return the cached sequence or None """
+        key = (chrom, start, end, -1 if strand == -1 else 1)
+        seq = self.entries.pop(key, None)
+        if seq is None:
+            key = self._enclosing(chrom, start, end)
+            if key is None:
+                self.misses += 1
+                return None
+            seq = self.entries.pop(key)
+            self.entries[key] = seq
+            seq = self._slice(key, seq, start, end, strand == -1)
+        else:
+            self.entries[key] = seq
+        self.hits += 1
+        return seq
+
+    def put(self, chrom, start, end, strand, seq):
+        """ add a sequence, evicting the least recently used entries """
+        key = (chrom, start, end, -1 if strand == -1 else 1)
+        if len(seq) > self.max_bytes or key in self.entries:
+            return
+        self.entries[key] = seq
+        self.bytes += len(seq)
+        starts = self.starts.setdefault(chrom, [])
+        i = bisect_right(starts, start)
+        starts.insert(i, start)
+        self.keys.setdefault(chrom, []).insert(i, key)
+        self.max_length[chrom] = max(self.max_length.get(chrom, 0), end - start)
+
+        while self.bytes > self.max_bytes:
+            self._evict(self.entries.popitem(last=False))
+
+    def _evict(self, item):
+        key, seq = item
+        self.bytes -= len(seq)
+        starts, keys = self.starts[key[0]], self.keys[key[0]]
+        i = bisect_left(starts, key[1])
+        while keys[i] != key:
+            i += 1
+        del starts[i], keys[i]
+
+    def _enclosing(self, chrom, start, end):
+        """ return the key of a cached region containing start-end """
+        starts = self.starts.get(chrom)
+        if not starts:
+            return None
+        keys = self.keys[chrom]
+        lo = bisect_left(starts, end - self.max_length[chrom])
+        for i in range(bisect_right(starts, start) - 1, lo - 1, -1):
+            if keys[i][2] >= end:
+                return keys[i]
+        return None
+
+    @staticmethod
+    def _slice(key, seq, start, end, reverse):
+        """ cut start-end out of the sequence cached under key """
+        _, region_start, region_end, region_strand = key
+        if region_strand == -1:
+            seq = seq[region_end - end:region_end - start]
+        else:
+            seq = seq[start - region_start:end - region_start]
+        if reverse != (region_strand == -1):
+            seq = _reverse_complement(seq)
+        return seq
+
+TWOBIT_SIGNATURE = 0x1A412743
+
+# 2bit packs T, C, A and G as 0-3, the first base in the high bits
+_TWOBIT_BASES = np.array([ord(x) for x in 'TCAG'], dtype=np.uint8)
+_TWOBIT_UNPACK = _TWOBIT_BASES[
+    (np.arange(256, dtype=np.uint8)[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3]
+_TWOBIT_PACK = np.zeros(256, dtype=np.uint8)
+for _code, _base in enumerate('TCAG'):
+    _TWOBIT_PACK[ord(_base)] = _TWOBIT_PACK[ord(_base.lower())] = _code
+del _code, _base
+
+def _runs(mask):
+    """ return the starts and sizes of the runs of True in a boolean array """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return edges[::2], edges[1::2] - edges[::2]
+
+def _read_fasta(fname):
+    """ yield the (name, sequence) records of a fasta file """
+    name, lines = None, []
+    for line in open(fname):
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(lines)
+            name, lines = line[1:].strip(), []
+        else:
+            lines.append(line.strip())
+    if name is not None:
+        yield name, ''.join(lines)
+
+def fasta_to_twobit(fasta_name, twobit_name=None):
+    """ convert a fasta file to a UCSC 2bit file and return its name
+
+    The 2bit file packs four bases to a byte and records runs of N and of
+    lower case (soft masked) bases as blocks, so the original sequence can
+    be recovered exactly for A, C, G, T and N.  By default the file is
+    written next to the fasta with a .2bit extension.
+    """
+    if twobit_name is None:
+        twobit_name = os.path.splitext(fasta_name)[0] + '.2bit'
+
+    names = [line[1:].strip() for line in open(fasta_name) if line.startswith('>')]
+    with open(twobit_name, 'wb') as out:
+        out.write(struct.pack('<4I', TWOBIT_SIGNATURE, 0, len(names), 0))
+        index_start = out.tell()
+        out.write(''.join(struct.pack('<B', len(x)) + x + '\0\0\0\0' for x in names))
+
+        offsets = []
+        for name, seq in _read_fasta(fasta_name):
+            offsets.append(out.tell())
+            bases = np.frombuffer(seq, dtype=np.uint8)
+            n_starts, n_sizes = _runs((bases == ord('N')) | (bases == ord('n')))
+            mask_starts, mask_sizes = _runs(bases >= ord('a'))
+
+            out.write(struct.pack('<2I', len(bases), len(n_starts)))
+            out.write(n_starts.astype('<u4').tostring() + n_sizes.astype('<u4').tostring())
+            out.write(struct.pack('<I', len(mask_starts)))
+            out.write(mask_starts.astype('<u4').tostring() + mask_sizes.astype('<u4').tostring())
+            out.write(struct.pack('<I', 0))
+
+            codes = _TWOBIT_PACK[bases]
+            codes = np.concatenate((codes, np.zeros(-len(codes) % 4, dtype=np.uint8)))
+            codes = codes.reshape(-1, 4)
+            out.write((codes[:, 0] << 6 | codes[:, 1] << 4 | codes[:, 2] << 2 | codes[:, 3]).tostring())
+
+        out.seek(index_start)
+        for name, offset in zip(names, offsets):
+            out.write(struct.pack('<B', len(name)) + name + struct.pack('<I', offset))
+    return twobit_name
+
+class _SequenceFile(Mapping):
+    """ The parts of the pyfasta Fasta interface used by Genome, for a mapping
+    of chromosome names to records that can be sliced for their sequence """
+
+    def sequence(self, f, one_based=True):
+        """ return the sequence of a pyfasta style feature dict """
+        seq = self[f['chr']][f['start'] - int(one_based):f['stop']]
+        if f.get('strand') in (-1, '-1', '-'):
+            seq = _reverse_complement(seq)
+        return seq
+
+def _is_up_to_date(a, b):
+    """ True if file a exists and is no older than b """
+    return os.path.exists(a) and os.stat(a).st_mtime >= os.stat(b).st_mtime
+
+class FlatRecord(object):
+    """ A chromosome of a FlatFile, sliced like a pyfasta record """
+
+    def __init__(self, bases):
+        self.bases = bases
+
+    def __len__(self):
+        return len(self.bases)
+
+    def __getitem__(self, islice):
+        if isinstance(islice, (int, long)):
+            islice = slice(islice, islice + 1 or None)
+        return self.bases[islice].tostring().decode()
+
+class FlatFile(_SequenceFile):
+    """ A fasta flattened by pyfasta, opened from its .gdx index without
+    pyfasta.  The flat file is memory mapped once, on first access, and
+    each chromosome is a slice of it. """
+
+    def __init__(self, fasta_name):
+        self.fasta_name = fasta_name
+        with open(fasta_name + '.gdx', 'rb') as fh:
+            self.index = cPickle.load(fh)
+
+        # pyfasta's flatten_inplace leaves a marker in .flat
+        self.flat_name = fasta_name + '.flat'
+        with open(self.flat_name, 'rb') as fh:
+            if fh.read(11) == '@flattened@':
+                self.flat_name = fasta_name
+        self.data = None
+        self.arrays = {}
+
+    @classmethod
+    def is_current(cls, fasta_name):
+        """ True if the fasta has an up to date .gdx index and .flat file """
+        return (_is_up_to_date(fasta_name + '.gdx', fasta_name)
+            and _is_up_to_date(fasta_name + '.flat', fasta_name))
+
+    def bases(self, chrom):
+        """ return the memory mapped uint8 array of a chromosome """
+        bases = self.arrays.get(chrom)
+        if bases is None:
+            start, stop = self.index[chrom]
+            if stop > start:
+                # one mapping, and so one file descriptor, for every chromosome
+                if self.data is None:
+                    self.data = np.memmap(self.flat_name, dtype=np.uint8, mode='r')
+                bases = self.data[start:stop]
+            else:
+                bases = np.zeros(0, dtype=np.uint8)
+            self.arrays[chrom] = bases
+        return bases
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, chrom):
+        return FlatRecord(self.bases(chrom))
+
+class TwoBitRecord(object):
+    """ A sequence in a 2bit file, sliced like a pyfasta record """
+
+    def __init__(self, data, offset):
+        read = lambda n: np.frombuffer(data, dtype='<u4', count=n, offset=offset)
+        self.length, n_blocks = map(int, read(2))
+        offset += 8
+        n_starts = read(2 * n_blocks)
+        offset += 8 * n_blocks
+        mask_blocks = int(read(1)[0])
+        offset += 4
+        mask_starts = read(2 * mask_blocks)
+        offset += 8 * mask_blocks + 4
+
+        self.n_starts = n_starts[:n_blocks].astype(np.int64)
+        self.n_ends = self.n_starts + n_starts[n_blocks:]
+        self.mask_starts = mask_starts[:mask_blocks].astype(np.int64)
+        self.mask_ends = self.mask_starts + mask_starts[mask_blocks:]
+        self.packed = data[offset:offset + (self.length + 3) // 4]
+
+    def __len__(self):
+        return self.length
+
+    def array(self, start, end, mask=True):
+        """ return the bases of start-end as a new uint8 array, in lower case
+        where soft masked if mask is True """
+        start, end = max(start, 0), min(end, len(self))
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+        bases = _TWOBIT_UNPACK[self.packed[start // 4:(end + 3) // 4]].ravel()
+        bases = bases[start % 4:start % 4 + end - start]
+
+        blocks = [(self.n_starts, self.n_ends, ord('N'))]
+        if mask:
+            blocks.append((self.mask_starts, self.mask_ends, None))
+        for starts, ends, base in blocks:
+            lo = np.searchsorted(ends, start, 'right')
+            hi = np.searchsorted(starts, end, 'left')
+            for block_start, block_end in zip(starts[lo:hi], ends[lo:hi]):
+                block = bases[max(block_start - start, 0):block_end - start]
+                if base is None:
+                    block |= 0x20
+                else:
+                    block[:] = base
+        return bases
+
+    def __getitem__(self, islice):
+        if isinstance(islice, (int, long)):
+            islice = slice(islice, islice + 1 or None)
+        start, end, step = islice.indices(len(self))
+        return self.array(start, end)[::step].tostring().decode()
+
+class TwoBitFile(_SequenceFile):
+    """ A memory mapped UCSC 2bit file, with the parts of the pyfasta Fasta
+    interface used by Genome.  Records are parsed on first access. """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.data = np.memmap(fname, dtype=np.uint8, mode='r')
+        signature, version, count, _ = struct.unpack('<4I', self.data[:16].tostring())
+        if signature != TWOBIT_SIGNATURE or version != 0:
+            raise Exception('%s is not a 2bit file' % fname)
+
+        self.offsets = OrderedDict()
+        pos = 16
+        for i in range(count):
+            size = int(self.data[pos])
+            name = self.data[pos + 1:pos + 1 + size].tostring()
+            self.offsets[name] = struct.unpack('<I', self.data[pos + 1 + size:pos + 5 + size].tostring())[0]
+            pos += 5 + size
+        self.records = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __getitem__(self, chrom):
+        record = self.records.get(chrom)
+        if record is None:
+            record = self.records[chrom] = TwoBitRecord(self.data, self.offsets[chrom])
+        return record
+
+_STRANDS = {'+': 1, '-': -1}
+
+def _open(fname):
+    """ open a text file, which may be gzipped """
+    with open(fname, 'rb') as fh:
+        magic = fh.read(2)
+    if magic == '\x1f\x8b':
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+def _read_rows(fname, chunksize, sep=None, skip=('#',), stop=None, fields=1,
+        whitespace=False):
+    """ yield lists of at most chunksize split rows, without blank lines or
+    lines starting with skip, up to any line starting with stop
+
+    Lines without sep are split on whitespace if whitespace is True, and
+    rows with fewer than fields columns raise an Exception naming the line.
+    """
+    fh = _open(fname)
+    lineno = 0
+    try:
+        while True:
+            lines = list(islice(fh, chunksize))
+            if not lines:
+                break
+            rows = []
+            for line in lines:
+                lineno += 1
+                if stop is not None and line.startswith(stop):
+                    lines = None
+                    break
+                if not line.strip() or line.startswith(skip):
+                    continue
+                line = line.rstrip('\r\n')
+                row = line.split() if whitespace and sep not in line else line.split(sep)
+                if len(row) < fields:
+                    raise Exception('%s line %s has %s fields, expected at least %s' % (
+                        fname, lineno, len(row), fields))
+                rows.append(row)
+            if rows:
+                yield rows
+            if lines is None:
+                break
+    finally:
+        fh.close()
+
+def _make_chunk(chroms, starts, ends, strands, values, genome, arrays):
+    """ return a chunk of records as an IntervalArray or list of Intervals """
+    if arrays:
+        if isinstance(genome, Genome):
+            return genome.interval_array(starts, ends, chrom=chroms, strand=strands)
+        return IntervalArray(starts, ends, chrom=chroms, strand=strands, genome=genome)
+    return [
+        Interval(int(start), int(end), chrom=chrom, strand=strand, value=value, genome=genome)
+        for chrom, start, end, strand, value in zip(chroms, starts, ends, strands, values)
+    ]
+
+def read_bed(fname, chunksize=100000, genome=None, arrays=False):
+    """ read a BED file, which may be gzipped, in chunks
+
+    Yields lists of at most chunksize Intervals with the name as value, or
+    IntervalArrays if arrays is True, so memory use does not grow with the
+    file.
+    """
+    for rows in _read_rows(fname, chunksize, sep='\t', skip=('#', 'track', 'browser'),
+            fields=3, whitespace=True):
+        columns = zip(*rows)
+        names = [x[3] if len(x) > 3 else None for x in rows]
+        strands = [_STRANDS.get(x[5]) if len(x) > 5 else None for x in rows]
+        yield _make_chunk(columns[0], np.array(columns[1], dtype=np.int64),
+            np.array(columns[2], dtype=np.int64), strands, names, genome, arrays)
+
+def write_bed(intervals, fname):
+    """ write intervals to a BED file as they are iterated, returning the
+    number written
+
+    fname may be a file name, gzipped if it ends .gz, or an open file.  The
+    value of each interval is written as the name, and the strand as
+    + or -; six columns are written if any of these are set, otherwise three.
+    """
+    if isinstance(fname, basestring):
+        fh = gzip.open(fname, 'wb') if fname.endswith('.gz') else open(fname, 'wb')
+    else:
+        fh = fname
+    strands = {1: '+', -1: '-'}
+    count = 0
+    try:
+        for x in intervals:
+            if x.value is None and not x.strand:
+                fh.write('%s\t%d\t%d\n' % (x.chrom, x.start, x.end))
+            else:
+                fh.write('%s\t%d\t%d\t%s\t0\t%s\n' % (x.chrom, x.start, x.end,
+                    '.' if x.value is None else x.value, strands.get(x.strand, '.')))
+            count += 1
+    finally:
+        if fh is not fname:
+            fh.close()
+    return count
+
+def read_gff(fname, chunksize=100000, genome=None, arrays=False):
+    """ read a GFF or GTF file, which may be gzipped, in chunks
+
+    As read_bed, with the one based, closed coordinates converted and the
+    attributes as value.  Reading stops at a ##FASTA section.
+    """
+    for rows in _read_rows(fname, chunksize, sep='\t', stop='##FASTA', fields=9):
+        columns = zip(*rows)
+        yield _make_chunk(columns[0], np.array(columns[3], dtype=np.int64) - 1,
+            np.array(columns[4], dtype=np.int64),
+            [_STRANDS.get(x) for x in columns[6]], columns[8], genome, arrays)
+
+def read_vcf(fname, chunksize=100000, genome=None, arrays=False):
+    """ read a VCF file, which may be gzipped, in chunks
+
+    As read_bed, with each record covering its reference allele and the
+    ID as value.
+    """
+    for rows in _read_rows(fname, chunksize, sep='\t', fields=5):
+        columns = zip(*rows)
+        starts = np.array(columns[1], dtype=np.int64) - 1
+        ends = starts + np.array([len(x) for x in columns[3]], dtype=np.int64)
+        yield _make_chunk(columns[0], starts, ends, [None] * len(rows),
+            columns[2], genome, arrays)
+
+# base codes for counting: A, C, G, T as 0-3 in either case and anything else 4
+_BASE_CODES = np.repeat(np.uint8(4), 256)
+for _i, _base in enumerate('ACGT'):
+    _BASE_CODES[ord(_base)] = _BASE_CODES[ord(_base.lower())] = _i
+del _i, _base
+
+# columns of G or C, and of any of ACGT, for each base code
+_GC_COLUMNS = np.array([[0, 1], [1, 1], [1, 1], [0, 1], [0, 0]], dtype=np.int32)
+
+def _span_groups(starts, ends, block):
+    """ yield (rows, lo, hi) for groups of intervals, in order of start, whose
+    starts lie within block bases, and the span lo-hi that they cover """
+    order = np.argsort(starts, kind='mergesort')
+    sorted_starts = starts[order]
+    i = 0
+    while i < len(order):
+        j = max(np.searchsorted(sorted_starts, sorted_starts[i] + block, 'left'), i + 1)
+        rows = order[i:j]
+        yield rows, sorted_starts[i], max(ends[rows].max(), sorted_starts[i])
+        i = j
+
+def _kmer_codes(codes, k):
+    """ return the code of the k-mer at each position of an array of base
+    codes, as a base 4 number, or -1 where it includes a base other than ACGT """
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kmers = np.zeros(n, dtype=np.int64)
+    for j in range(k):
+        kmers = kmers * 4 + codes[j:j + n]
+    other = np.concatenate(([0], np.cumsum(codes == 4)))
+    kmers[other[k:] - other[:n] > 0] = -1
+    return kmers
+
+def _reverse_complement_kmers(k):
+    """ return the code of the reverse complement of each k-mer code """
+    codes = np.arange(4 ** k)
+    result = np.zeros(4 ** k, dtype=np.int64)
+    for j in range(k):
+        result = result * 4 + 3 - (codes // 4 ** j) % 4
+    return result
+
+def _window_starts(length, size, step, partial):
+    """ return the starts of the windows over a chromosome, stopping at the
+    first window to reach the end, which is cut short if partial is True """
+    if partial:
+        return np.arange(0, max(length - size, 0) + step, step, dtype=np.int64)[:max(length, 0)]
+    return np.arange(0, max(length - size + 1, 0), step, dtype=np.int64)
+
+def _n_before(run_starts, run_ends, positions):
+    """ return the number of bases inside the sorted runs before each position """
+    lengths = np.concatenate(([0], np.cumsum(run_ends - run_starts)))
+    i = np.searchsorted(run_starts, positions, 'right')
+    last = np.maximum(i - 1, 0)
+    partial = np.clip(positions - run_starts[last], 0, (run_ends - run_starts)[last]) if len(run_starts) else 0
+    return np.where(i > 0, lengths[last] + partial, 0)
+
+class Genome(Mapping):
     """ A convienience for creating intervals on the same genome """
 
     def __init__(self, fname, *args, **kws):
-        """ Create a genome using a Fasta file. Other args passed to pyfasta """
-        self.fasta = Fasta(fname, *args, **kws)
+        """ Create a genome using a Fasta file. Other args passed to pyfasta
+
+        A file ending .2bit is opened as a TwoBitFile instead.  With
+        lazy=True the fasta is opened as a FlatFile, which reads pyfasta's
+        .gdx index and maps each chromosome on first use; pyfasta is only
+        imported if the index needs building.  fname may also be an already
+        open pyfasta Fasta, FlatFile or TwoBitFile.  If cache_bytes is given,
+        sequences fetched through this genome are kept in a SequenceCache of
+        that size, available as genome.cache.
+        """
+        cache_bytes = kws.pop('cache_bytes', None)
+        lazy = kws.pop('lazy', False)
+        if not isinstance(fname, basestring):
+            self.fasta = fname
+        elif fname.endswith('.2bit'):
+            self.fasta = TwoBitFile(fname)
+        elif lazy and FlatFile.is_current(fname):
+            self.fasta = FlatFile(fname)
+        else:
+            from pyfasta import Fasta
+            self.fasta = Fasta(fname, *args, **kws)
+            if lazy:
+                self.fasta = FlatFile(fname)
+        self.cache = SequenceCache(cache_bytes) if cache_bytes else None
+        self.gc_tables = {}
+
+    # the fasta interface, for code that used interval.genome as the Fasta
+
+    def __getitem__(self, chrom):
+        return self.fasta[chrom]
+
+    def __iter__(self):
+        return iter(self.fasta)
+
+    def __len__(self):
+        return len(self.fasta)
+
+    def __contains__(self, chrom):
+        return chrom in self.fasta
+
+    def keys(self):
+        return self.fasta.keys()
+
+    # compare by identity rather than reading every sequence as Mapping would
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    __hash__ = object.__hash__
+
+    def sequence(self, *args, **kws):
+        return self.fasta.sequence(*args, **kws)
 
     def interval(self, start, end, **kws):
         """ return an interval on this genome """
-        return Interval(start, end, genome=self.fasta, **kws)
+        return Interval(start, end, genome=self, **kws)
+
+    def fetch(self, chrom, start, end, strand=None):
+        """ return the upper case DNA of a region, reverse complemented if
+        strand is -1, going through the cache if there is one.  The region
+        is clipped to the chromosome, as in sequences and view. """
+        # as pyfasta, which reverse complements all of these
+        strand = -1 if strand in (-1, '-1', '-') else 1
+        if _STATS is None:
+            return self._fetch(chrom, start, end, strand)
+        began = time.time()
+        seq = self._fetch(chrom, start, end, strand)
+        _count('fetch.calls')
+        _count('fetch.bytes', len(seq))
+        _count('fetch.seconds', time.time() - began)
+        return seq
+
+    def _fetch(self, chrom, start, end, strand):
+        start, end = _clamp(start, end, len(self.fasta[chrom]))
+        cache = self.cache
+        if cache is not None:
+            seq = cache.get(chrom, start, end, strand)
+            if _STATS is not None:
+                _count('cache.hits' if seq is not None else 'cache.misses')
+            if seq is not None:
+                return seq
+
+        seq = self.fasta.sequence(dict(
+            start = start,
+            stop = end,
+            chr = chrom,
+            strand = strand
+        ), one_based=False).upper()
+
+        if cache is not None:
+            cache.put(chrom, start, end, strand, seq)
+        return seq
+
+    def chrom_lengths(self):
+        """ return a dict of chromosome lengths """
+        return dict((chrom, len(self.fasta[chrom])) for chrom in self.fasta.keys())
+
+    def view(self, chrom, start, end):
+        """ return a uint8 numpy array of a forward strand region, sharing
+        memory with the mmapped flat file.  The region is clipped to the
+        chromosome.  A 2bit genome returns a decoded copy. """
+        if isinstance(self.fasta, TwoBitFile):
+            return self.fasta[chrom].array(start, end)
+        bases = _flat_bases(self.fasta, chrom)
+        if bases is None:
+            raise Exception('Cannot view sequence without the numpy flat file')
+        start = min(max(start, 0), len(bases))
+        return bases[start:max(start, end)]
+
+    def interval_array(self, starts, ends, chrom=None, strand=None):
+        """ return an IntervalArray on this genome
+
+        The chromosome codes follow the sorted chromosome names of the fasta.
+        """
+        n = len(starts)
+        chroms, codes = _encode_chroms(chrom, n, sorted(self.fasta.keys()))
+        return IntervalArray.from_columns(
+            chroms, codes, starts, ends, _encode_strands(strand, n),
+            genome=self
+        )
+
+    def sequences(self, intervals):
+        """ return the DNA of a list of intervals or an IntervalArray
+
+        The requests are sorted by their offset in the flattened fasta and
+        read in one pass, and the sequences returned in the original order.
+        As for Interval.sequence they are upper case and reverse complemented
+        for the reverse strand.
+        """
+        if not isinstance(intervals, IntervalArray):
+            intervals = IntervalArray.from_intervals(intervals)
+        return _fetch_sequences(self.fasta, intervals)
+
+    def _clipped_groups(self, intervals, block):
+        """ yield (chrom, rows, starts, ends, lo, hi) for groups of intervals
+        clipped to their chromosome, see _span_groups """
+        for chrom, rows in intervals.chrom_rows():
+            length = len(self.fasta[chrom])
+            starts = np.clip(intervals.starts[rows], 0, length)
+            ends = np.maximum(np.clip(intervals.ends[rows], 0, length), starts)
+            for group, lo, hi in _span_groups(starts, ends, block):
+                yield chrom, rows[group], starts[group], ends[group], lo, hi
+
+    def gc_content(self, intervals, tables=False, block=1 << 20):
+        """ return the fraction of G or C among the A, C, G and T bases of
+        each of a list of intervals or an IntervalArray, nan if there are none
+
+        The bases are counted with numpy from the memory mapped file, a
+        block of nearby intervals at a time.  With tables=True a cumulative
+        count table is built for each chromosome used and kept in
+        gc_tables, taking 8 bytes per base, so later calls are O(1) per
+        interval.
+        """
+        if not isinstance(intervals, IntervalArray):
+            intervals = IntervalArray.from_intervals(intervals)
+        counts = np.zeros((len(intervals), 2), dtype=np.int64)
+
+        for chrom, rows, starts, ends, lo, hi in self._clipped_groups(intervals, block):
+            if tables:
+                table = self.gc_tables.get(chrom)
+                if table is None:
+                    table = self.gc_tables[chrom] = self._gc_table(chrom, 0, len(self.fasta[chrom]))
+                lo = 0
+            else:
+                table = self._gc_table(chrom, lo, hi)
+            counts[rows] = table[ends - lo] - table[starts - lo]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return counts[:, 0] / counts[:, 1].astype(float)
+
+    def _gc_table(self, chrom, start, end):
+        """ return the cumulative (GC, ACGT) counts from start to each base """
+        table = np.zeros((end - start + 1, 2), dtype=np.int32)
+        np.cumsum(_GC_COLUMNS[_BASE_CODES[self.view(chrom, start, end)]], axis=0, out=table[1:])
+        return table
+
+    def kmer_counts(self, intervals, k, block=1 << 20):
+        """ return an array of the counts of each k-mer in each interval
+
+        Row i holds the counts for interval i, read on its strand, with a
+        column for each k-mer in the order of itertools.product('ACGT',
+        repeat=k).  k-mers including other bases, such as N, are not counted.
+        """
+        if not isinstance(intervals, IntervalArray):
+            intervals = IntervalArray.from_intervals(intervals)
+        n_kmers = 4 ** k
+        counts = np.zeros((len(intervals), n_kmers), dtype=np.int64)
+
+        for chrom, rows, starts, ends, lo, hi in self._clipped_groups(intervals, block):
+            kmers = _kmer_codes(_BASE_CODES[self.view(chrom, lo, hi)], k)
+
+            # the k-mer starts of each interval, one after another
+            sizes = np.maximum(ends - starts - k + 1, 0)
+            owner = np.repeat(np.arange(len(rows)), sizes)
+            offsets = np.repeat(starts - lo - np.cumsum(sizes) + sizes, sizes)
+            found = kmers[np.arange(sizes.sum()) + offsets]
+            valid = found >= 0
+            counts[rows] = np.bincount(
+                owner[valid] * n_kmers + found[valid], minlength=len(rows) * n_kmers
+            ).reshape(len(rows), n_kmers)
+
+        reverse = intervals.strands < 0
+        if reverse.any():
+            complement = _reverse_complement_kmers(k)
+            reversed_counts = np.zeros_like(counts[reverse])
+            reversed_counts[:, complement] = counts[reverse]
+            counts[reverse] = reversed_counts
+        return counts
+
+    def n_runs(self, chrom):
+        """ return (starts, ends) arrays of the runs of N in a chromosome """
+        if isinstance(self.fasta, TwoBitFile):
+            record = self.fasta[chrom]
+            return record.n_starts, record.n_ends
+
+        bases = self.view(chrom, 0, len(self.fasta[chrom]))
+        starts, ends = [], []
+        block = 1 << 24
+        for offset in range(0, len(bases), block):
+            chunk = bases[offset:offset + block]
+            run_starts, run_sizes = _runs((chunk == ord('N')) | (chunk == ord('n')))
+            starts.append(run_starts + offset)
+            ends.append(run_starts + run_sizes + offset)
+        starts = np.concatenate(starts or [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        ends = np.concatenate(ends or [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+
+        # join runs split at a block boundary
+        split = np.flatnonzero(starts[1:] == ends[:-1])
+        return np.delete(starts, split + 1), np.delete(ends, split)
+
+    def windows(self, size, step=None, chroms=None, with_sequence=False,
+            partial=True, max_n=None, batch_size=100000):
+        """ yield IntervalArray batches of windows tiling the genome
+
+        Windows of size bases start every step bases (by default step is
+        size) from the start of each chromosome, in chroms or all of them
+        in sorted order, until a window reaches the end.  With partial=True
+        that last window is cut short at the chromosome end, otherwise only
+        whole windows are made.  If max_n is given, windows with more than
+        that fraction of N bases are skipped, so max_n=0 skips any window
+        touching a gap.  Each batch holds up to batch_size windows of one
+        chromosome.  With with_sequence=True (batch, views) pairs are
+        yielded, where views is a list of a SequenceView of each window,
+        sharing memory with the flat file.
+        """
+        step = step or size
+        if size < 1 or step < 1:
+            raise Exception('window size and step must be positive')
+        if chroms is None:
+            chroms = sorted(self.fasta.keys())
+
+        for chrom in chroms:
+            length = len(self.fasta[chrom])
+            all_starts = _window_starts(length, size, step, partial)
+            if max_n is not None:
+                run_starts, run_ends = self.n_runs(chrom)
+
+            for offset in range(0, len(all_starts), batch_size):
+                starts = all_starts[offset:offset + batch_size]
+                ends = np.minimum(starts + size, length)
+                if max_n is not None:
+                    n = _n_before(run_starts, run_ends, ends) - _n_before(run_starts, run_ends, starts)
+                    keep = n <= max_n * (ends - starts)
+                    starts, ends = starts[keep], ends[keep]
+                    if not len(starts):
+                        continue
+
+                batch = self.interval_array(starts, ends, chrom=chrom)
+                if with_sequence:
+                    yield batch, [
+                        SequenceView(self.view(chrom, start, end), None)
+                        for start, end in zip(starts.tolist(), ends.tolist())
+                    ]
+                else:
+                    yield batch
+
+    def iter_sequences(self, intervals, prefetch=16, threads=4):
+        """ yield the DNA of each interval in order, reading ahead in threads
+
+        While the current sequence is being used, the regions of the next
+        prefetch intervals are paged in from the memory mapped file by a
+        pool of background threads.  intervals may be any iterable and is
+        consumed as the sequences are yielded.  The sequences are as for
+        fetch, and go through the cache if there is one.
+        """
+        intervals = iter(intervals)
+        if prefetch < 1:
+            for x in intervals:
+                yield self.fetch(x.chrom, x.start, x.end, x.strand)
+            return
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(threads)
+        pending = deque()
+        read_ahead = lambda x: _page_in(_region_bytes(self.fasta, x.chrom, x.start, x.end))
+        try:
+            for x in islice(intervals, prefetch):
+                pending.append((x, pool.apply_async(read_ahead, (x,))))
+            while pending:
+                x, result = pending.popleft()
+                for y in islice(intervals, 1):
+                    pending.append((y, pool.apply_async(read_ahead, (y,))))
+                result.wait()
+                yield self.fetch(x.chrom, x.start, x.end, x.strand)
+        finally:
+            pool.terminate()
+
+    def read_bed(self, fname, chunksize=100000, arrays=False):
+        """ read a BED file in chunks of intervals on this genome, see read_bed """
+        return read_bed(fname, chunksize, genome=self, arrays=arrays)
+
+    def read_gff(self, fname, chunksize=100000, arrays=False):
+        """ read a GFF file in chunks of intervals on this genome, see read_gff """
+        return read_gff(fname, chunksize, genome=self, arrays=arrays)
+
+    def read_vcf(self, fname, chunksize=100000, arrays=False):
+        """ read a VCF file in chunks of intervals on this genome, see read_vcf """
+        return read_vcf(fname, chunksize, genome=self, arrays=arrays)
 
     def from_string(self, data):
         """docstring for from_string"""
-        return Interval.from_string(data, genome=self.fasta)
+        return Interval.from_string(data, genome=self)
+
+    def from_strings(self, locs, arrays=False):
+        """ parse many locus strings into intervals on this genome, see
+        Interval.from_strings """
+        if not arrays:
+            return Interval.from_strings(locs, genome=self)
+        chroms, starts, ends, strands, bad = _parse_loci(locs)
+        return self.interval_array(starts, ends, chrom=chroms, strand=strands), bad
+
+def _segment_counts(bounds, intervals):
+    """ return the number of intervals covering each segment between bounds,
+    which must include every start and end """
+    deltas = np.zeros(len(bounds), dtype=np.int64)
+    np.add.at(deltas, np.searchsorted(bounds, [x.start for x in intervals]), 1)
+    np.add.at(deltas, np.searchsorted(bounds, [x.end for x in intervals]), -1)
+    return np.cumsum(deltas)[:-1]
+
+class _TargetIndex(object):
+    """ The remaining targets of a spanning set, per chromosome and sorted by
+    start, so the targets overlapping a candidate can be found by bisection """
+
+    def __init__(self, targets):
+        self.starts = {}
+        self.targets = {}
+        self.max_length = {}
+        for target in sorted(targets, key=lambda x: (x.chrom, x.start)):
+            self.starts.setdefault(target.chrom, []).append(target.start)
+            self.targets.setdefault(target.chrom, []).append(target)
+            self.max_length[target.chrom] = max(
+                self.max_length.get(target.chrom, 0), len(target))
+
+    def __iter__(self):
+        for chrom in sorted(self.targets):
+            for target in self.targets[chrom]:
+                yield target
+
+    def _window(self, candidate):
+        """ return the slice of targets that can overlap candidate """
+        starts = self.starts.get(candidate.chrom)
+        if not starts:
+            return 0, 0
+        lo = bisect_right(starts, candidate.start - self.max_length[candidate.chrom])
+        hi = bisect_left(starts, candidate.end)
+        return lo, hi
+
+    def score(self, candidate):
+        """ return the number of target bases the candidate covers """
+        lo, hi = self._window(candidate)
+        score = 0
+        for target in self.targets[candidate.chrom][lo:hi] if hi > lo else ():
+            if target.end > candidate.start:
+                score += min(target.end, candidate.end) - max(target.start, candidate.start)
+        return score
+
+    def remove(self, choice):
+        """ subtract choice from the targets it overlaps """
+        lo, hi = self._window(choice)
+        if hi <= lo:
+            return
+        targets = self.targets[choice.chrom]
+        window = []
+        for target in targets[lo:hi]:
+            if target.end > choice.start:
+                window.extend(target - choice)
+            else:
+                window.append(target)
+        window.sort(key=lambda x: x.start)
+        targets[lo:hi] = window
+        self.starts[choice.chrom][lo:hi] = [x.start for x in window]
+
+class _Reversed(object):
+    """ Invert the ordering of a value, to pop the largest from a heap """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
 
 class MinimalSpanningSet(object):
-    """ Create a minimal spanning set for target intervals from a set of candidates """
+    """ Create a minimal spanning set for target intervals from a set of candidates
+
+    At each step the candidate covering most of the remaining target bases
+    is chosen.  If given, sort_key breaks ties, preferring the largest key.
+    The default solver rescores every candidate at every step.  The 'lazy'
+    solver gives the same result, but keeps the candidates in a heap and
+    only rescores the best one when its score is out of date.
+
+    Chromosomes do not affect each other, so with n_jobs each chromosome
+    is solved in a separate process (n_jobs=-1 uses every cpu).  An
+    executor, any object with an order preserving map method such as a
+    multiprocessing.Pool, can be given instead to reuse a pool.  Only the
+    coordinates and sort keys are sent to the workers.  The same intervals
+    are chosen, but ordered by chromosome.
+
+    With components=True each chromosome is further split by a sweep into
+    groups of targets and candidates that share no bases with any other
+    group, and each group is solved on its own, in parallel if asked.
+    Again the same intervals are chosen, ordered by chromosome and group.
+    """
 
     def score_candidate(self, candidate):
         return sum([
@@ -338,7 +2736,9 @@ class MinimalSpanningSet(object):
         return sum(map(len, covered))
 
 
-    def __init__(self, targets, candidates, score_function=None, sort_key=None):
+    @_timed('spanning_set')
+    def __init__(self, targets, candidates, score_function=None, sort_key=None,
+            solver='greedy', n_jobs=None, executor=None, components=False):
         self.targets = targets
         self.remaining_targets = list(targets)
         self.candidates = candidates
@@ -346,7 +2746,14 @@ class MinimalSpanningSet(object):
         self.sort_key = sort_key
         if score_function is None:
             self.score_function = MinimalSpanningSet.score_candidate
-        self._find_set()
+        if solver not in ('greedy', 'lazy'):
+            raise Exception('unknown solver %s' % solver)
+        if components or n_jobs is not None or executor is not None:
+            self._find_set_split(solver, components, n_jobs, executor)
+        elif solver == 'greedy':
+            self._find_set()
+        else:
+            self._find_set_lazy()
 
 
     def _find_set(self):
@@ -358,6 +2765,9 @@ class MinimalSpanningSet(object):
             # work out the score by summing the length of overlaps with the target
             for candidate in self.candidates:
                 scores[candidate] = self.score_candidate(candidate)
+            if _STATS is not None:
+                _count('spanning_set.iterations')
+                _count('spanning_set.rescored', len(self.candidates))
 
             # choose the best candidates
             rankings = sorted(self.candidates, key=scores.get, reverse=True)
@@ -387,6 +2797,109 @@ class MinimalSpanningSet(object):
 
         self._remove_redundant()
 
+    def _find_set_lazy(self):
+        """ main loop of the lazy greedy solver
+
+        A candidate's score can only fall as targets are covered, so a score
+        from an earlier step is an upper bound.  When the top of the heap was
+        scored in this step no other candidate can beat it.
+        """
+        index = _TargetIndex(self.remaining_targets)
+        candidates = list(self.candidates)
+
+        # ties go to the first candidate, or to the largest (sort_key, position)
+        if self.sort_key:
+            tie = lambda i: _Reversed((self.sort_key(candidates[i]), i))
+        else:
+            tie = lambda i: i
+
+        heap = [
+            (-index.score(candidate), tie(i), 0, i)
+            for i, candidate in enumerate(candidates)
+        ]
+        heapq.heapify(heap)
+        if _STATS is not None:
+            _count('spanning_set.rescored', len(heap))
+
+        while heap:
+            score, key, step, i = heap[0]
+
+            # break if no improvement is possible
+            if score == 0:
+                break
+
+            if step < len(self.chosen):
+                heapq.heapreplace(heap, (-index.score(candidates[i]), key, len(self.chosen), i))
+                if _STATS is not None:
+                    _count('spanning_set.rescored')
+                continue
+
+            if _STATS is not None:
+                _count('spanning_set.iterations')
+            heapq.heappop(heap)
+            self.chosen.append(candidates[i])
+            index.remove(candidates[i])
+
+        chosen = set(map(id, self.chosen))
+        self.candidates[:] = [x for x in candidates if id(x) not in chosen]
+        self.remaining_targets = list(index)
+        self._remove_redundant()
+
+    def _find_set_split(self, solver, components, n_jobs, executor):
+        """ solve each chromosome, or each component, as a separate problem
+        and collect the results """
+        targets = _rows_by_chrom(self.targets)
+        candidates = _rows_by_chrom(self.candidates)
+        groups = []
+        for chrom in sorted(set(targets) & set(candidates)):
+            if components:
+                groups.extend(
+                    (chrom, target_rows, candidate_rows)
+                    for target_rows, candidate_rows in _components(
+                        self.targets, targets[chrom], self.candidates, candidates[chrom])
+                )
+            else:
+                groups.append((chrom, targets[chrom], candidates[chrom]))
+
+        keys = None
+        if self.sort_key:
+            keys = [self.sort_key(x) for x in self.candidates]
+
+        # pack small problems together so each job is worth sending
+        jobs, problems, size = [], [], 0
+        for chrom, target_rows, candidate_rows in groups:
+            problems.append((
+                chrom,
+                _coordinates(self.targets, target_rows),
+                _coordinates(self.candidates, candidate_rows),
+                [keys[i] for i in candidate_rows] if keys else None
+            ))
+            size += len(target_rows) + len(candidate_rows)
+            if size >= _SPANNING_SET_JOB_SIZE:
+                jobs.append((problems, solver))
+                problems, size = [], 0
+        if problems:
+            jobs.append((problems, solver))
+        results = list(chain.from_iterable(_map_jobs(_spanning_set_job, jobs, n_jobs, executor)))
+
+        # targets outside every problem are left alone
+        picked, solved = set(), set()
+        remaining = []
+        for (chrom, target_rows, rows), (chosen, unchosen, pieces) in zip(groups, results):
+            self.chosen.extend(self.candidates[rows[i]] for i in chosen)
+            picked.update(set(rows) - set(rows[i] for i in unchosen))
+            solved.update(target_rows)
+            remaining.extend((target_rows[i], start, end) for i, start, end in pieces)
+        remaining.extend(
+            (i, x.start, x.end) for i, x in enumerate(self.targets) if i not in solved
+        )
+
+        self.candidates[:] = [x for i, x in enumerate(self.candidates) if i not in picked]
+        self.remaining_targets = [
+            self.targets[i].copy(start=start, end=end)
+            for i, start, end in sorted(remaining)
+        ]
+
     def _update_targets(self, choice):
         """ remove chosen interval from targets """
         new_targets = []
@@ -395,16 +2908,35 @@ class MinimalSpanningSet(object):
         self.remaining_targets = new_targets
 
     def _remove_redundant(self):
-        """ drop any candidates that are completely covered by the rest"""
-
-        total_coverage = self.coverage(self.chosen)
-
-        for c in list(self.chosen):
-            # if the coverage without a choice is the same, remove it
-            test = list(self.chosen)
-            test.remove(c)
-            if self.coverage(test) == total_coverage:
-                self.chosen.remove(c)
-
+        """ drop any candidates that are completely covered by the rest
 
+        The target bases are cut into segments at every target and choice
+        boundary, and the choices covering each segment are counted.  A
+        choice is redundant if every target segment it covers has a count
+        of at least two.
+        """
+        targets, choices = {}, {}
+        for target in self.targets:
+            targets.setdefault(target.chrom, []).append(target)
+        for choice in self.chosen:
+            choices.setdefault(choice.chrom, []).append(choice)
+
+        segments = {}
+        for chrom in choices:
+            intervals = targets.get(chrom, []) + choices[chrom]
+            bounds = np.unique([x.start for x in intervals] + [x.end for x in intervals])
+            segments[chrom] = (
+                bounds,
+                _segment_counts(bounds, targets.get(chrom, [])) > 0,
+                _segment_counts(bounds, choices[chrom])
+            )
 
+        kept = []
+        for c in self.chosen:
+            bounds, on_target, counts = segments[c.chrom]
+            lo, hi = np.searchsorted(bounds, [c.start, c.end])
+            if np.all(counts[lo:hi][on_target[lo:hi]] > 1):
+                counts[lo:hi] -= 1
+            else:
+                kept.append(c)
+        self.chosen[:] = kept
@@ -1,7 +1,18 @@
-from fastinterval import Interval, Genome, MinimalSpanningSet
+from fastinterval import Interval, Genome, MinimalSpanningSet, IntervalArray, \
+    TwoBitFile, FlatFile, fasta_to_twobit, read_bed, read_gff, CompactInterval, \
+    IntervalSet, IntervalIndex
 import fastinterval
 import pyfasta
 import doctest
+import multiprocessing
+import random
+import shutil
+import tempfile
+import os
+import gzip
+import itertools
+import numpy
+import pickle
 
 
 suite = doctest.DocTestSuite(fastinterval)
@@ -19,6 +30,48 @@ def test_Interval_from_string():
     assert a.end == 10967
     assert a.strand == -1
 
+def test_Interval_from_strings():
+    locs = ['chr1:10858-10967:1', 'chr1:10858-10967:-1', 'chr2:5-10:+',
+        'chr2:5-10:-', 'chr3:1-2:', 'chr3:1-2', 'chr1:10-x', 'chr1:10-20:?', None, '']
+    intervals, bad = Interval.from_strings(locs, value='v')
+    assert bad == [6, 7, 8, 9]
+    assert [str(x) for x in intervals] == [
+        str(Interval.from_string(x)) for x in locs[:6]]
+    assert intervals[0].value == 'v'
+
+    arr, bad = Interval.from_strings(iter(locs), arrays=True)
+    assert bad == [6, 7, 8, 9]
+    assert list(arr.strands) == [1, -1, 1, -1, 0, 0]
+    assert arr.chroms == ('chr1', 'chr2', 'chr3')
+
+    genome = Genome('test/mixed.fa')
+    arr, bad = genome.from_strings(['chr1:0-10', 'chrM:5-10:-'], arrays=True)
+    assert arr.sequences == [genome.from_string('chr1:0-10').sequence,
+        genome.from_string('chrM:5-10:-').sequence]
+    intervals, bad = genome.from_strings(['chr1:0-10'])
+    assert intervals[0].genome is genome
+
+def test_CompactInterval():
+    genome = Genome('test/mixed.fa')
+    a = CompactInterval(100, 200, chrom=''.join(['ch', 'r1']), strand='-', genome=genome)
+    b = CompactInterval(150, 300, chrom='chr1', genome=genome)
+    assert not hasattr(a, '__dict__')
+    assert a.chrom is b.chrom
+    assert a.strand == -1
+    assert a.sequence == genome.interval(100, 200, chrom='chr1', strand=-1).sequence
+
+    assert type(a.copy()) is CompactInterval
+    assert a.copy(end=120).end == 120
+    assert [str(x) for x in a - b] == ['chr1:100-150:-1']
+    assert str(a.intersection(b)) == 'chr1:150-200:'
+    assert str(a.union(b)) == 'chr1:100-300:-1'
+    assert a.distance(b) == 0 and a.overlaps(b)
+    assert [str(x) for x in Interval.merge([a, b])] == ['chr1:100-300:-1']
+
+    c = pickle.loads(pickle.dumps(b, -1))
+    assert type(c) is CompactInterval
+    assert str(c) == str(b)
+
 def test_Interval_sequence():
     genome = pyfasta.Fasta('test/example.fa')
     l1 = Interval.from_string('1:858-967:1', genome=genome)
@@ -32,9 +85,375 @@ def test_Genome():
     genome = Genome('test/example.fa')
     i1 = genome.interval(10, 20, chrom='1')
     print 'genome is', i1.genome
-    assert i1.genome == genome.fasta
+    assert i1.genome is genome
     assert i1.sequence
 
+    # the genome still works where the pyfasta Fasta did
+    assert i1.genome.keys() == genome.fasta.keys()
+    assert list(i1.genome) == list(genome.fasta)
+    assert len(i1.genome) == len(genome.fasta)
+    assert i1.genome != Genome('test/example.fa') and len(set([genome, genome])) == 1
+    assert [(k, str(v[:10])) for k, v in i1.genome.items()] == \
+        [(k, str(v[:10])) for k, v in genome.fasta.items()]
+    assert '1' in i1.genome
+    assert str(i1.genome['1'][10:20]) == str(genome.fasta['1'][10:20])
+    assert i1.genome.sequence(dict(chr='1', start=10, stop=20, strand=1),
+        one_based=False).upper() == i1.sequence
+
+
+def test_Genome_sequences():
+    genome = Genome('test/mixed.fa')
+    rand = random.Random(3)
+    intervals = []
+    for i in range(50):
+        chrom = rand.choice(['chr1', 'chr2', 'chrM'])
+        start = rand.randint(0, 790)
+        intervals.append(genome.interval(start, start + rand.randint(0, 200),
+            chrom=chrom, strand=rand.choice([1, -1, None])))
+    expected = [x.sequence for x in intervals]
+    assert genome.sequences(intervals) == expected
+    assert IntervalArray.from_intervals(intervals).sequences == expected
+
+    records = Genome('test/mixed.fa', record_class=pyfasta.FastaRecord)
+    assert records.sequences(intervals) == expected
+
+    # out of range regions are clipped to the chromosome on every path
+    lengths = genome.chrom_lengths()
+    cached = Genome('test/mixed.fa', cache_bytes=10000)
+    cached.fetch('chr1', 0, lengths['chr1'])
+    for start, end in [(-5, 10), (-20, -10), (790, 810), (805, 820)]:
+        for strand in (1, -1):
+            region = genome.interval(start, end, chrom='chr1', strand=strand)
+            clipped = genome.interval(*fastinterval._clamp(start, end, lengths['chr1']),
+                chrom='chr1', strand=strand)
+            assert region.sequence == clipped.sequence
+            assert genome.sequences([region]) == [region.sequence]
+            assert cached.fetch('chr1', start, end, strand) == region.sequence
+    assert genome.fetch('chr1', -5, 10) == genome.fetch('chr1', 0, 10)
+    assert genome.fetch('chr1', -20, -10) == ''
+
+def test_Genome_iter_sequences():
+    rand = random.Random(3)
+    genome = Genome('test/mixed.fa')
+    lengths = genome.chrom_lengths()
+    intervals = []
+    for i in range(50):
+        chrom = rand.choice(sorted(lengths))
+        start = rand.randint(0, lengths[chrom])
+        intervals.append(genome.interval(start, start + rand.randint(0, 200),
+            chrom=chrom, strand=rand.choice([1, -1, None])))
+    expected = [x.sequence for x in intervals]
+
+    for prefetch in (0, 1, 8):
+        assert list(genome.iter_sequences(iter(intervals), prefetch=prefetch)) == expected
+    assert list(genome.iter_sequences(IntervalArray.from_intervals(intervals))) == expected
+    assert list(Genome('test/mixed.fa', lazy=True).iter_sequences(intervals)) == expected
+
+    tmp = tempfile.mkdtemp()
+    try:
+        twobit = Genome(fasta_to_twobit('test/mixed.fa', os.path.join(tmp, 'mixed.2bit')))
+        sequences = twobit.iter_sequences(intervals, prefetch=4, threads=2)
+        assert [next(sequences) for i in range(3)] == expected[:3]
+        sequences.close()
+    finally:
+        shutil.rmtree(tmp)
+
+def test_Genome_windows():
+    genome = Genome('test/mixed.fa')
+    lengths = genome.chrom_lengths()
+    assert [list(x) for x in genome.n_runs('chr2')] == [[0, 450], [50, 475]]
+
+    for size, step, partial in [(100, 50, True), (300, 200, False), (97, None, True)]:
+        windows = []
+        for batch in genome.windows(size, step, partial=partial, batch_size=5):
+            assert len(batch) <= 5 and batch.genome is genome
+            windows.extend(batch)
+        expected = []
+        for chrom in sorted(lengths):
+            for start in range(0, lengths[chrom], step or size):
+                end = min(start + size, lengths[chrom])
+                if partial or end - start == size:
+                    expected.append((chrom, start, end))
+                if start + size >= lengths[chrom]:
+                    break
+        assert [(x.chrom, x.start, x.end) for x in windows] == expected
+
+    batches = list(genome.windows(300, 200, chroms=['chr2', 'chr1'], with_sequence=True, max_n=0.1))
+    windows = [(x.chrom, x.start, x.end) for batch, views in batches for x in batch]
+    assert windows == [('chr2', 200, 475), ('chr1', 0, 300), ('chr1', 600, 800)]
+    for batch, views in batches:
+        assert [x.sequence for x in views] == [x.sequence for x in batch]
+
+    tmp = tempfile.mkdtemp()
+    try:
+        twobit = Genome(fasta_to_twobit('test/mixed.fa', os.path.join(tmp, 'mixed.2bit')))
+        assert [str(x) for x in sum(map(list, twobit.windows(50, max_n=0)), [])] == \
+            [str(x) for x in sum(map(list, genome.windows(50, max_n=0)), [])]
+    finally:
+        shutil.rmtree(tmp)
+
+def test_Genome_gc_content_kmer_counts():
+    rand = random.Random(11)
+    genome = Genome('test/mixed.fa')
+    lengths = genome.chrom_lengths()
+    intervals = []
+    for i in range(40):
+        chrom = rand.choice(sorted(lengths))
+        start = rand.randint(-10, lengths[chrom])
+        intervals.append(genome.interval(start, start + rand.randint(0, 150),
+            chrom=chrom, strand=rand.choice([1, -1, None])))
+
+    gc = []
+    for x in intervals:
+        seq = x.sequence
+        bases = sum(seq.count(base) for base in 'ACGT')
+        gc.append((seq.count('G') + seq.count('C')) / float(bases) if bases else None)
+    for result in (genome.gc_content(intervals, block=100),
+            genome.gc_content(intervals, tables=True)):
+        assert [None if numpy.isnan(x) else round(x, 10) for x in result] == \
+            [None if x is None else round(x, 10) for x in gc]
+    assert sorted(genome.gc_tables) == sorted(set(x.chrom for x in intervals))
+
+    k = 2
+    kmers = [''.join(x) for x in itertools.product('ACGT', repeat=k)]
+    expected = [
+        [sum(seq[i:i + k] == kmer for i in range(len(seq) - k + 1)) for kmer in kmers]
+        for seq in (x.sequence for x in intervals)
+    ]
+    assert genome.kmer_counts(intervals, k, block=100).tolist() == expected
+
+    tmp = tempfile.mkdtemp()
+    try:
+        twobit = Genome(fasta_to_twobit('test/mixed.fa', os.path.join(tmp, 'mixed.2bit')))
+        assert twobit.kmer_counts(intervals, k).tolist() == expected
+    finally:
+        shutil.rmtree(tmp)
+
+def test_Genome_cache():
+    plain = Genome('test/mixed.fa')
+    genome = Genome('test/mixed.fa', cache_bytes=300)
+    assert genome.cache.stats() == dict(hits=0, misses=0, entries=0, bytes=0)
+
+    region = genome.interval(100, 300, chrom='chr1', strand=-1)
+    assert region.sequence == plain.interval(100, 300, chrom='chr1', strand=-1).sequence
+    assert region.sequence == plain.interval(100, 300, chrom='chr1', strand=-1).sequence
+    assert genome.cache.stats() == dict(hits=1, misses=1, entries=1, bytes=200)
+
+    # sub regions on either strand come from the enclosing entry
+    for start, end, strand in [(100, 150, 1), (120, 300, -1), (150, 151, None)]:
+        expected = plain.interval(start, end, chrom='chr1', strand=strand).sequence
+        assert genome.fetch('chr1', start, end, strand) == expected
+    assert genome.cache.hits == 4
+
+    # a second region overflows the budget and evicts the first
+    genome.fetch('chr2', 0, 150)
+    assert genome.cache.stats() == dict(hits=4, misses=2, entries=1, bytes=150)
+    assert genome.fetch('chr1', 100, 150) == plain.fetch('chr1', 100, 150)
+    assert genome.cache.misses == 3
+
+    # too big to cache at all
+    genome.fetch('chr1', 0, 500)
+    assert genome.cache.bytes == 200
+
+    # the string strands pyfasta reverse complements share the -1 entries
+    genome = Genome('test/mixed.fa', cache_bytes=10000)
+    reverse = plain.fetch('chr1', 100, 120, -1)
+    assert genome.fetch('chr1', 100, 120, '-') == reverse
+    assert genome.fetch('chr1', 100, 120, 1) == plain.fetch('chr1', 100, 120, 1)
+    assert genome.interval(100, 120, chrom='chr1', strand='-1').sequence == reverse
+    assert genome.cache.stats() == dict(hits=2, misses=1, entries=1, bytes=20)
+
+def test_stats():
+    assert fastinterval.stats() == {}
+    updates = []
+    fastinterval.add_stats_hook(lambda name, value: updates.append(name))
+    fastinterval.enable_stats()
+    try:
+        genome = Genome('test/mixed.fa', cache_bytes=1000)
+        genome.fetch('chr1', 0, 100)
+        genome.interval(10, 50, chrom='chr1').sequence
+        genome.sequences([genome.interval(0, 30, chrom='chr2')])
+        Interval.merge([Interval(0, 10), Interval(5, 20)])
+        targets = [Interval(0, 100), Interval(200, 300)]
+        candidates = [Interval(0, 60), Interval(50, 100), Interval(40, 80), Interval(200, 300)]
+        MinimalSpanningSet(targets, list(candidates))
+        MinimalSpanningSet(targets, list(candidates), solver='lazy')
+
+        counts = fastinterval.stats()
+        assert counts['fetch.calls'] == 2
+        assert counts['fetch.bytes'] == 140
+        assert counts['cache.misses'] == 1 and counts['cache.hits'] == 1
+        assert counts['sequences.calls'] == 1 and counts['sequences.bytes'] == 30
+        assert counts['spanning_set.calls'] == 2
+        assert counts['spanning_set.iterations'] == 4 + 3
+        assert counts['spanning_set.rescored'] > len(candidates)
+        assert counts['merge.seconds'] >= 0
+        assert set(updates) == set(counts)
+
+        fastinterval.reset_stats()
+        assert fastinterval.stats() == {}
+    finally:
+        fastinterval.disable_stats()
+        del fastinterval._STATS_HOOKS[:]
+    genome.fetch('chr1', 0, 100)
+    assert fastinterval.stats() == {}
+
+def test_Interval_sequence_view():
+    genome = Genome('test/mixed.fa')
+    raw = genome.view('chr1', 410, 430)
+    assert not raw.flags.owndata
+    assert raw.tostring() == genome.fasta['chr1'][410:430]
+    assert len(genome.view('chrM', 90, 200)) == 7
+
+    for strand in (1, -1, None):
+        interval = genome.interval(400, 440, chrom='chr1', strand=strand)
+        view = interval.sequence_view()
+        assert len(view) == 40
+        assert view.sequence == interval.sequence
+        for base in 'ACGTN':
+            assert view.count(base) == interval.sequence.count(base)
+
+def test_TwoBitFile():
+    tmp = tempfile.mkdtemp()
+    try:
+        fasta = pyfasta.Fasta('test/mixed.fa')
+        fname = fasta_to_twobit('test/mixed.fa', os.path.join(tmp, 'mixed.2bit'))
+        twobit = TwoBitFile(fname)
+        assert list(twobit) == ['chr1', 'chr2', 'chrM']
+        for chrom in twobit:
+            assert len(twobit[chrom]) == len(fasta[chrom])
+            assert twobit[chrom][:] == fasta[chrom][:]
+
+        rand = random.Random(5)
+        for i in range(100):
+            chrom = rand.choice(['chr1', 'chr2', 'chrM'])
+            start = rand.randint(-10, 800)
+            end = start + rand.randint(0, 100)
+            assert twobit[chrom][max(start, 0):end] == fasta[chrom][max(start, 0):end]
+
+        plain = Genome('test/mixed.fa')
+        genome = Genome(fname)
+        assert isinstance(genome.fasta, TwoBitFile)
+        for strand in (1, -1):
+            interval = genome.interval(280, 540, chrom='chr1', strand=strand)
+            expected = plain.interval(280, 540, chrom='chr1', strand=strand).sequence
+            assert interval.sequence == expected
+            assert interval.sequence_view().sequence == expected
+        assert genome.sequences([interval]) == [expected]
+    finally:
+        shutil.rmtree(tmp)
+
+def test_Genome_lazy():
+    plain = Genome('test/mixed.fa')
+    genome = Genome('test/mixed.fa', lazy=True)
+    assert isinstance(genome.fasta, FlatFile)
+    assert genome.fasta.arrays == {}
+    interval = genome.interval(280, 540, chrom='chr1', strand=-1)
+    assert interval.sequence == plain.interval(280, 540, chrom='chr1', strand=-1).sequence
+    assert genome.fasta.arrays.keys() == ['chr1']
+    assert interval.sequence_view().sequence == interval.sequence
+    assert genome.sequences([interval]) == [interval.sequence]
+    assert sorted(genome.fasta) == ['chr1', 'chr2', 'chrM']
+
+    # the index is built on first use
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, 'mixed.fa')
+        shutil.copy('test/mixed.fa', fname)
+        assert not FlatFile.is_current(fname)
+        genome = Genome(fname, lazy=True)
+        assert FlatFile.is_current(fname)
+        assert genome.fetch('chrM', 10, 20) == plain.fetch('chrM', 10, 20)
+    finally:
+        shutil.rmtree(tmp)
+
+def test_FlatFile_many_contigs():
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, 'contigs.fa')
+        with open(fname, 'w') as fh:
+            for i in range(300):
+                fh.write('>contig%s\nACGTN\n' % i)
+        Genome(fname)
+        genome = Genome(fname, lazy=True)
+        open_files = lambda: len(os.listdir('/proc/self/fd'))
+        before = open_files() if os.path.exists('/proc/self/fd') else None
+        assert sum(len(batch) for batch in genome.windows(2)) == 900
+        assert genome.fetch('contig299', 0, 5) == 'ACGTN'
+        if before is not None:
+            assert open_files() <= before + 1
+    finally:
+        shutil.rmtree(tmp)
+
+def test_read_bed():
+    chunks = list(read_bed('test/example.bed', chunksize=3))
+    assert [len(x) for x in chunks] == [1, 2, 1]
+    intervals = sum(chunks, [])
+    assert [str(x) for x in intervals] == [
+        'chr1:10-20:1', 'chr1:100-150:-1', 'chr2:60-90:', 'chrM:0-97:']
+    assert [x.value for x in intervals] == ['first', 'second', 'third', None]
+
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, 'example.bed.gz')
+        fh = gzip.open(fname, 'wb')
+        fh.write(open('test/example.bed').read())
+        fh.close()
+        genome = Genome('test/mixed.fa')
+        arrays = list(genome.read_bed(fname, arrays=True))
+        assert len(arrays) == 1
+        assert arrays[0].genome is genome
+        assert list(arrays[0].strands) == [1, -1, 0, 0]
+        assert [str(x) for x in arrays[0]] == [str(x) for x in intervals]
+
+        # names may contain spaces when the file is tab separated
+        fname = os.path.join(tmp, 'spaces.bed')
+        with open(fname, 'w') as fh:
+            fh.write('chr1\t10\t20\tmy name\t0\t-\nchr2 5 8 other 0 +\n')
+        intervals = sum(read_bed(fname), [])
+        assert [x.value for x in intervals] == ['my name', 'other']
+        assert [x.strand for x in intervals] == [-1, 1]
+
+        with open(fname, 'w') as fh:
+            fh.write('chr1\t10\t20\nchr1\t30\n')
+        try:
+            list(read_bed(fname))
+            assert False, 'short row should raise'
+        except Exception as e:
+            assert 'line 2' in str(e)
+    finally:
+        shutil.rmtree(tmp)
+
+def test_read_gff_malformed():
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, 'example.gff')
+        gff = open('test/example.gff').read()
+        with open(fname, 'w') as fh:
+            fh.write(gff + '##FASTA\n>chr1\nACGT\n')
+        intervals = sum(read_gff(fname, chunksize=2), [])
+        assert [str(x) for x in intervals] == ['chr1:10-20:1', 'chr2:60-90:-1']
+
+        with open(fname, 'w') as fh:
+            fh.write(gff + 'chr3\texample\texon\t1\t5\n')
+        try:
+            list(read_gff(fname))
+            assert False, 'short row should raise'
+        except Exception as e:
+            assert 'line 4' in str(e)
+    finally:
+        shutil.rmtree(tmp)
+
+def test_Genome_read_gff_vcf():
+    genome = Genome('test/mixed.fa')
+    intervals = sum(genome.read_gff('test/example.gff'), [])
+    assert [str(x) for x in intervals] == ['chr1:10-20:1', 'chr2:60-90:-1']
+    assert intervals[1].value == 'ID=gene1;Name=g'
+    assert intervals[0].genome is genome
+
+    intervals = sum(genome.read_vcf('test/example.vcf', chunksize=2), [])
+    assert [str(x) for x in intervals] == ['chr1:14-15:', 'chr1:100-103:', 'chrM:4-5:']
+    assert [x.value for x in intervals] == ['rs1', '.', 'rs3']
 
 def test_Interval_distance():
     l1 = Interval.from_string('chr1:10858-10967:1')
@@ -160,6 +579,119 @@ def test_Interval_merge():
     assert m.start == 10000
     assert m.end == 12964
 
+    merged = Interval.merge([l1, l2, l3], value='x')
+    assert merged[0].value == 'x'
+
+    # chained and contained intervals, with and without contiguous merging
+    intervals = [Interval(s, s + 10, chrom='chr1') for s in range(0, 1000, 10)]
+    intervals += [Interval(5, 15, chrom='chr2'), Interval(0, 100, chrom='chr2')]
+    merged = Interval.merge(intervals)
+    assert [str(x) for x in merged] == [str(x) for x in intervals[:100]] + ['chr2:0-100:']
+    merged = Interval.merge(intervals, merge_contiguous=True)
+    assert [str(x) for x in merged] == ['chr1:0-1000:', 'chr2:0-100:']
+
+def test_Interval_imerge():
+    intervals = [
+        Interval.from_string('chr1:100-200'),
+        Interval.from_string('chr1:150-180'),
+        Interval.from_string('chr1:190-300'),
+        Interval.from_string('chr1:300-400'),
+        Interval.from_string('chr2:100-200'),
+        Interval.from_string('chr2:200-250'),
+    ]
+    merged = Interval.imerge(iter(intervals))
+    assert [str(x) for x in merged] == [
+        'chr1:100-300:', 'chr1:300-400:', 'chr2:100-200:', 'chr2:200-250:']
+    merged = Interval.imerge(intervals, merge_contiguous=True, strand=1)
+    assert [str(x) for x in merged] == ['chr1:100-400:1', 'chr2:100-250:1']
+
+    # the input intervals are left untouched
+    assert str(intervals[0]) == 'chr1:100-200:'
+
+    merged = Interval.imerge(intervals[::-1], presorted=False)
+    assert [str(x) for x in merged] == [str(x) for x in Interval.merge(intervals)]
+
+    for bad in (intervals[1::-1], intervals[:1] + intervals[4:] + intervals[1:2]):
+        try:
+            list(Interval.imerge(bad))
+            assert False
+        except Exception, e:
+            assert 'not sorted' in str(e)
+
+def test_Interval_kmerge():
+    rand = random.Random(23)
+    genome = Genome('test/mixed.fa')
+    sources = []
+    for i in range(4):
+        source = []
+        for j in range(50):
+            start = rand.randint(0, 3000)
+            source.append(genome.interval(start, start + rand.randint(1, 100),
+                chrom=rand.choice(['chr1', 'chr10', 'chr2']), value='s%s' % i))
+        source.sort(key=lambda x: (x.chrom, x.start))
+        sources.append(source)
+    everything = sum(sources, [])
+
+    for merge_contiguous in (False, True):
+        expected = [str(x) for x in Interval.merge(everything, merge_contiguous=merge_contiguous)]
+        merged = Interval.kmerge(map(iter, sources), merge_contiguous=merge_contiguous)
+        assert [str(x) for x in merged] == expected
+        shuffled = list(everything)
+        rand.shuffle(shuffled)
+        merged = list(Interval.kmerge([shuffled[:120], shuffled[120:]], presorted=False,
+            merge_contiguous=merge_contiguous, chunksize=30))
+        assert [str(x) for x in merged] == expected
+        assert all(x.genome is genome and x.value.startswith('s') for x in merged)
+
+    order = ['chr1', 'chr2', 'chr10']
+    natural = [sorted(x, key=lambda x: (order.index(x.chrom), x.start)) for x in sources]
+    merged = list(Interval.kmerge(natural, chrom_order=order))
+    assert [x.chrom for x in merged] == sorted((x.chrom for x in merged), key=order.index)
+    assert len(merged) == len(Interval.merge(everything))
+
+    for bad in ([sources[0][::-1]], natural):
+        try:
+            list(Interval.kmerge(bad))
+            assert False
+        except Exception, e:
+            assert 'not sorted' in str(e)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        names = [os.path.join(tmp, 'sample%s.bed.gz' % i) for i in range(len(sources))]
+        for name, source in zip(names, sources):
+            assert fastinterval.write_bed(source, name) == len(source)
+        output = os.path.join(tmp, 'merged.bed')
+        count = fastinterval.write_bed(Interval.kmerge(names, strand=1), output)
+        merged = sum(read_bed(output), [])
+        assert count == len(merged)
+        assert [str(x) for x in merged] == \
+            [str(x.copy(strand=1)) for x in Interval.merge(everything)]
+        assert [x.value for x in sum(read_bed(names[0]), [])] == ['s0'] * len(sources[0])
+    finally:
+        shutil.rmtree(tmp)
+
+def test_Interval_coverage():
+    intervals = [
+        Interval.from_string('chr1:0-10'),
+        Interval.from_string('chr1:5-10'),
+        Interval.from_string('chr1:10-20'),
+        Interval.from_string('chr1:30-40'),
+        Interval.from_string('chr2:0-10'),
+        Interval.from_string('chr2:2-4'),
+    ]
+    cov = Interval.coverage(intervals)
+    assert [(str(x), x.value) for x in cov] == [
+        ('chr1:0-5:', 1), ('chr1:5-10:', 2), ('chr1:10-20:', 1), ('chr1:30-40:', 1),
+        ('chr2:0-2:', 1), ('chr2:2-4:', 2), ('chr2:4-10:', 1),
+    ]
+    arrays = Interval.coverage(IntervalArray.from_intervals(intervals), arrays=True)
+    starts, ends, depths = arrays['chr2']
+    assert list(starts) == [0, 2, 4]
+    assert list(ends) == [2, 4, 10]
+    assert list(depths) == [1, 2, 1]
+    assert Interval.coverage([]) == []
+
 def test_find_minimal_spanning_set():
 
     targets = [
@@ -211,12 +743,303 @@ def test_find_minimal_spanning_set():
     reads = MinimalSpanningSet(targets, candidates)
     assert len(reads.chosen) == 2
 
+def test_minimal_spanning_set_lazy():
+    rand = random.Random(42)
+    for trial in range(10):
+        targets = []
+        for i in range(10):
+            start = rand.randint(0, 5000)
+            targets.append(Interval(start, start + rand.randint(50, 300),
+                chrom=rand.choice(['chr1', 'chr2'])))
+        candidates = []
+        for i in range(100):
+            start = rand.randint(0, 5000)
+            candidates.append(Interval(start, start + rand.randint(50, 150),
+                chrom=rand.choice(['chr1', 'chr2']), value=rand.randint(0, 3)))
+
+        for sort_key in (None, lambda x: x.value):
+            greedy = MinimalSpanningSet(targets, list(candidates), sort_key=sort_key)
+            lazy = MinimalSpanningSet(targets, list(candidates), sort_key=sort_key,
+                solver='lazy')
+            assert greedy.chosen
+            assert map(id, lazy.chosen) == map(id, greedy.chosen)
+            assert len(lazy.candidates) == len(greedy.candidates)
+            assert sum(map(len, lazy.remaining_targets)) == \
+                sum(map(len, greedy.remaining_targets))
+
+def test_parallel_jobs():
+    rand = random.Random(5)
+    genome = Genome('test/mixed.fa')
+    targets, candidates = [], []
+    for i in range(30):
+        start = rand.randint(0, 2000)
+        targets.append(genome.interval(start, start + rand.randint(50, 300),
+            chrom=rand.choice(['chr1', 'chr2', 'chrM'])))
+    for i in range(150):
+        start = rand.randint(0, 2000)
+        candidates.append(genome.interval(start, start + rand.randint(50, 150),
+            chrom=rand.choice(['chr1', 'chr2', 'chr3']), value=rand.randint(0, 3)))
+
+    pool = multiprocessing.Pool(2)
+    try:
+        for parallel in (dict(n_jobs=2), dict(executor=pool)):
+            merged = Interval.merge(candidates, strand=1, **parallel)
+            assert merged == Interval.merge(candidates, strand=1)
+            assert [x.chrom for x in merged] == [x.chrom for x in Interval.merge(candidates)]
+            assert all(x.genome is genome and x.strand == 1 for x in merged)
+            assert Interval.coverage(candidates, **parallel) == Interval.coverage(candidates)
+
+            for solver in ('greedy', 'lazy'):
+                serial = MinimalSpanningSet(targets, list(candidates),
+                    sort_key=lambda x: x.value, solver=solver)
+                reads = MinimalSpanningSet(targets, list(candidates),
+                    sort_key=lambda x: x.value, solver=solver, **parallel)
+                by_chrom = sorted(serial.chosen, key=lambda x: x.chrom)
+                assert map(id, reads.chosen) == map(id, by_chrom)
+                assert map(id, reads.candidates) == map(id, serial.candidates)
+                assert sorted(map(str, reads.remaining_targets)) == \
+                    sorted(map(str, serial.remaining_targets))
+    finally:
+        pool.close()
+        pool.join()
+
+def test_minimal_spanning_set_components():
+    rand = random.Random(31)
+    targets, candidates = [], []
+    for i in range(60):
+        start = rand.randint(0, 20000)
+        targets.append(Interval(start, start + rand.randint(50, 300),
+            chrom=rand.choice(['chr1', 'chr2'])))
+    for i in range(400):
+        start = rand.randint(0, 20000)
+        candidates.append(Interval(start, start + rand.randint(50, 150),
+            chrom=rand.choice(['chr1', 'chr2', 'chr3']), value=rand.randint(0, 3)))
+
+    groups = fastinterval._components(targets, range(len(targets)),
+        candidates, range(len(candidates)))
+    assert len(groups) > 20
+    seen = sum([rows for rows, _ in groups], [])
+    assert len(seen) == len(set(seen))
+
+    for solver in ('greedy', 'lazy'):
+        serial = MinimalSpanningSet(targets, list(candidates),
+            sort_key=lambda x: x.value, solver=solver)
+        for parallel in ({}, dict(n_jobs=2)):
+            split = MinimalSpanningSet(targets, list(candidates), sort_key=lambda x: x.value,
+                solver=solver, components=True, **parallel)
+            assert sorted(map(id, split.chosen)) == sorted(map(id, serial.chosen))
+            assert [x.chrom for x in split.chosen] == sorted(x.chrom for x in split.chosen)
+            assert map(id, split.candidates) == map(id, serial.candidates)
+            assert sorted(map(str, split.remaining_targets)) == \
+                sorted(map(str, serial.remaining_targets))
+
+def test_minimal_spanning_set_remove_redundant():
+    rand = random.Random(7)
+    for trial in range(20):
+        targets = [Interval(s, s + rand.randint(20, 200), chrom=rand.choice(['chr1', 'chr2']))
+            for s in (rand.randint(0, 2000) for i in range(10))]
+        choices = [Interval(s, s + rand.randint(20, 200), chrom=rand.choice(['chr1', 'chr3']))
+            for s in (rand.randint(0, 2000) for i in range(30))]
+        reads = MinimalSpanningSet(targets, [])
+
+        # reference: drop each choice in turn if the rest cover the same bases
+        expected = list(choices)
+        total = reads.coverage(expected)
+        for c in list(expected):
+            rest = [x for x in expected if x is not c]
+            if reads.coverage(rest) == total:
+                expected = rest
+
+        reads.chosen = list(choices)
+        reads._remove_redundant()
+        assert map(id, reads.chosen) == map(id, expected)
+        assert reads.coverage(reads.chosen) == total
+
+def test_IntervalSet():
+    rand = random.Random(11)
+    def random_intervals(n):
+        result = []
+        for i in range(n):
+            start = rand.randint(0, 400)
+            result.append(Interval(start, start + rand.randint(0, 60),
+                chrom=rand.choice(['chr1', 'chr2', 'chrM'])))
+        return result
+
+    def bases(intervals):
+        return set((x.chrom, i) for x in intervals for i in range(x.start, x.end))
+
+    for trial in range(20):
+        a, b = random_intervals(15), random_intervals(10)
+        sa, sb = IntervalSet(a), IntervalSet(IntervalArray.from_intervals(b))
+        assert bases(sa) == bases(a)
+        assert sa.total_length() == len(bases(a))
+        for result, expected in [
+                (sa | sb, bases(a) | bases(b)),
+                (sa & sb, bases(a) & bases(b)),
+                (sa - sb, bases(a) - bases(b)),
+                (sa ^ sb, bases(a) ^ bases(b))]:
+            intervals = list(result)
+            assert bases(intervals) == expected
+            # sorted, merged and not touching
+            for x, y in zip(intervals, intervals[1:]):
+                assert (x.chrom, x.end) < (y.chrom, y.start)
+
+    genome = Genome('test/mixed.fa')
+    merged = IntervalSet([genome.interval(0, 100, chrom='chr1'),
+        genome.interval(100, 200, chrom='chr1'), genome.interval(10, 20, chrom='chrM')])
+    assert [str(x) for x in merged] == ['chr1:0-200:', 'chrM:10-20:']
+    assert [str(x) for x in merged.complement()] == [
+        'chr1:200-800:', 'chr2:0-475:', 'chrM:0-10:', 'chrM:20-97:']
+    assert list(merged.to_array().ends) == [200, 20]
+
+    # intervals on a plain pyfasta Fasta, and a dict of lengths
+    fasta = pyfasta.Fasta('test/mixed.fa')
+    on_fasta = IntervalSet([Interval(0, 100, chrom='chr1', genome=fasta),
+        Interval(10, 20, chrom='chrM', genome=fasta)])
+    assert [str(x) for x in on_fasta.complement()] == [
+        'chr1:100-800:', 'chr2:0-475:', 'chrM:0-10:', 'chrM:20-97:']
+    assert [str(x) for x in on_fasta.complement({'chr1': 150})] == ['chr1:100-150:']
+
+def test_IntervalIndex_closest():
+    rand = random.Random(13)
+    intervals = []
+    for i in range(60):
+        start = rand.randint(0, 1000)
+        intervals.append(Interval(start, start + rand.randint(0, 40),
+            chrom=rand.choice(['chr1', 'chr2']), strand=rand.choice([1, -1])))
+    queries = []
+    for i in range(40):
+        start = rand.randint(-50, 1050)
+        queries.append(Interval(start, start + rand.randint(0, 20),
+            chrom=rand.choice(['chr1', 'chr2', 'chr3']), strand=rand.choice([1, -1])))
+    index = IntervalIndex(intervals)
+
+    for strand_aware in (False, True):
+        for max_distance in (None, 15):
+            for k in (1, 3):
+                rows, distances = index.closest_many(queries, k=k,
+                    strand_aware=strand_aware, max_distance=max_distance)
+                for qi, query in enumerate(queries):
+                    candidates = [x for x in intervals if
+                        not strand_aware or x.strand == query.strand]
+                    expected = sorted(x.distance(query) for x in candidates
+                        if x.chrom == query.chrom)
+                    if max_distance is not None:
+                        expected = [x for x in expected if x <= max_distance]
+                    expected = expected[:k]
+                    hits = index.closest(query, k=k, strand_aware=strand_aware,
+                        max_distance=max_distance)
+                    assert [d for x, d in hits] == expected
+                    for hit, d in hits:
+                        assert hit.distance(query) == d
+                    assert [intervals[r] for r in rows[qi] if r >= 0] == [x for x, d in hits]
+                    assert list(distances[qi][:len(hits)]) == expected
+
+    contiguous = IntervalIndex([Interval(10, 20, chrom='chr1'), Interval(30, 40, chrom='chr1')])
+    assert contiguous.closest(Interval(20, 25, chrom='chr1'))[0][1] == 0
+    assert contiguous.closest(Interval(26, 27, chrom='chr1'))[0][1] == 3
+    assert contiguous.closest(Interval(26, 27, chrom='chrX')) == []
+
+def test_IntervalIndex_closest_long_interval():
+    # one interval spanning the chromosome overlaps every query, which should
+    # not mean walking every row for k > 1
+    intervals = [Interval(0, 10 ** 6, chrom='chr1')]
+    intervals += [Interval(i * 50, i * 50 + 10, chrom='chr1') for i in range(20000)]
+    index = IntervalIndex(intervals)
+    query = Interval(500030, 500035, chrom='chr1')
+    hits = index.closest(query, k=3)
+    assert [(x.start, d) for x, d in hits] == [(0, 0), (500050, 15), (500000, 20)]
+    assert [d for x, d in hits] == sorted(x.distance(query) for x in intervals)[:3]
+    overlap = index.closest(Interval(500005, 500010, chrom='chr1'), k=2)
+    assert [(x.start, d) for x, d in overlap] == [(0, 0), (500000, 0)]
+
+def test_IntervalIndex_overlapping():
+    rand = random.Random(17)
+    intervals = []
+    for i in range(300):
+        start = rand.randint(0, 5000)
+        size = rand.choice([rand.randint(1, 30), rand.randint(1, 2000)])
+        intervals.append(Interval(start, start + size, chrom=rand.choice(['chr1', 'chr2']),
+            strand=rand.choice([1, -1, None])))
+    queries = []
+    for i in range(100):
+        start = rand.randint(-100, 5200)
+        queries.append(Interval(start, start + rand.randint(1, 300),
+            chrom=rand.choice(['chr1', 'chr2', 'chr3'])))
+
+    index = IntervalIndex(intervals)
+    expected = []
+    for query in queries:
+        hits = [x for x in intervals if x.chrom == query.chrom and x.overlaps(query)]
+        expected.append(sorted(str(x) for x in hits))
+        found = index.overlapping(query)
+        assert sorted(map(id, found)) == sorted(id(x) for x in hits)
+        assert [x.start for x in found] == sorted(x.start for x in hits)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        index.save(os.path.join(tmp, 'index'))
+        genome = Genome('test/mixed.fa')
+        loaded = IntervalIndex.load(os.path.join(tmp, 'index'), genome=genome)
+        assert isinstance(loaded._get_tree().max_ends, numpy.memmap)
+        assert len(loaded) == len(index)
+        for query, hits in zip(queries, expected):
+            found = loaded.overlapping(query)
+            assert sorted(map(str, found)) == hits
+            assert all(x.genome is genome for x in found)
+        assert numpy.all(loaded.closest_many(queries)[0] == index.closest_many(queries)[0])
+
+        # built from the chunks of the streaming readers
+        by_lists = IntervalIndex(read_bed('test/example.bed', chunksize=2))
+        by_arrays = IntervalIndex(genome.read_bed('test/example.bed', chunksize=2, arrays=True))
+        query = Interval(0, 1000, chrom='chr1')
+        assert map(str, by_lists.overlapping(query)) == ['chr1:10-20:1', 'chr1:100-150:-1']
+        assert by_lists.intervals is None and len(by_lists) == 4
+        assert map(str, by_arrays.overlapping(query)) == ['chr1:10-20:1', 'chr1:100-150:-1']
+    finally:
+        shutil.rmtree(tmp)
+
 def test_add_border():
     l1 = Interval.from_string('chr1:10000-10967:1')
     l2 = l1.add_border(upstream=50, downstream=100)
     assert l2.start == 10000 - 50
     assert l2.end == 10967 + 100
 
+def test_add_border_clamp():
+    genome = Genome('test/mixed.fa')
+    near_start = genome.interval(10, 50, chrom='chrM', strand=-1)
+    assert near_start.add_border(size=20, clamp=True).start == 0
+    clamped = near_start.add_border(upstream=100, downstream=5, clamp=True)
+    assert (clamped.start, clamped.end, clamped.genome) == (5, 97, genome)
+    assert str(genome.interval(-5, 120, chrom='chrM').clamp()) == 'chrM:0-97:'
+    assert str(Interval(-5, 120, chrom='chrM').clamp()) == 'chrM:0-120:'
+    assert str(Interval(90, 120, chrom='chrM').clamp(100)) == 'chrM:90-100:'
+
+def test_IntervalArray_clamped_transforms():
+    genome = Genome('test/mixed.fa')
+    arr = genome.interval_array([10, 60, 90], [50, 90, 97], chrom='chrM', strand=[1, -1, None])
+    assert list(arr.chrom_lengths()) == [97, 97, 97]
+    slopped = arr.slop(20)
+    assert (list(slopped.starts), list(slopped.ends)) == ([0, 40, 70], [70, 97, 97])
+    assert list(arr.slop(20, lengths={'chrM': 100}).ends) == [70, 100, 100]
+    assert list(arr.add_border(20).starts) == [-10, 40, 70]
+
+    upstream = arr.flank(15)
+    assert (list(upstream.starts), list(upstream.ends)) == ([0, 90, 75], [10, 97, 90])
+    downstream = arr.flank(15, upstream=False, clamp=False)
+    assert (list(downstream.starts), list(downstream.ends)) == ([50, 45, 97], [65, 60, 112])
+
+    shifted = arr.shift(10, strand_aware=True, clamp=True)
+    assert (list(shifted.starts), list(shifted.ends)) == ([20, 50, 97], [60, 80, 97])
+
+    for anchor, starts in [('start', [10, 85, 90]), ('end', [45, 60, 92]), ('center', [28, 73, 91])]:
+        resized = arr.resize(5, anchor=anchor)
+        assert list(resized.starts) == starts, anchor
+        assert list(resized.lengths()) == [5, 5, 5]
+
+    outside = arr.shift(200).clamp()
+    assert list(outside.starts) == [97, 97, 97] and list(outside.lengths()) == [0, 0, 0]
+
 def test_truncate():
     l1 = Interval.from_string('chr1:10000-10967:1')
     l2 = l1.truncate(100)
@@ -228,5 +1051,67 @@ def test_truncate():
     assert l2.start == 10867
     assert l2.end == 10967
 
+def test_IntervalArray_roundtrip():
+    intervals = [
+        Interval.from_string('chr1:10000-10967:1'),
+        Interval.from_string('chr2:10858-10964:-1'),
+        Interval.from_string('chr1:20858-30001'),
+    ]
+    arr = IntervalArray.from_intervals(intervals)
+    assert len(arr) == 3
+    assert list(arr.lengths()) == [967, 106, 9143]
+    back = arr.to_intervals()
+    assert [str(x) for x in back] == [str(x) for x in intervals]
+    assert str(arr[1]) == 'chr2:10858-10964:-1'
+    assert [str(x) for x in arr[arr.strands != 0]] == [str(x) for x in intervals[:2]]
+
+def test_IntervalArray_predicates():
+    intervals = [
+        Interval.from_string('chr1:10000-10967:1'),
+        Interval.from_string('chr1:10858-10964:-1'),
+        Interval.from_string('chr1:20858-30000:-1'),
+        Interval.from_string('chr1:30000-30001:-1'),
+        Interval.from_string('chr2:10000-10967:1'),
+    ]
+    arr = IntervalArray.from_intervals(intervals)
+    for other in intervals:
+        assert list(arr.distance(other)) == [x.distance(other) for x in intervals]
+        assert list(arr.overlaps(other)) == [x.overlaps(other) for x in intervals]
+        assert list(arr.is_contiguous(other)) == [x.is_contiguous(other) for x in intervals]
+        assert list(arr.contains(other)) == [other in x for x in intervals]
+
+    # element-wise against another array with a different chrom table
+    shifted = IntervalArray.from_intervals(intervals[::-1])
+    assert list(arr.overlaps(shifted)) == [
+        x.overlaps(y) for x, y in zip(intervals, intervals[::-1])]
 
+    inter = arr.intersection(intervals[0])
+    assert [len(x) for x in inter] == [967, 106, 0, 0, 0]
 
+def test_IntervalArray_transforms():
+    arr = IntervalArray.from_intervals([
+        Interval.from_string('chr1:10000-10967:1'),
+        Interval.from_string('chr1:10000-10967:-1'),
+    ])
+    bordered = arr.add_border(upstream=50, downstream=100)
+    assert list(bordered.starts) == [9950, 9900]
+    assert list(bordered.ends) == [11067, 11017]
+    truncated = arr.truncate(100)
+    assert list(truncated.starts) == [10000, 10867]
+    assert list(truncated.ends) == [10100, 10967]
+    spanned = arr.span(Interval.from_string('chr1:10500-12000'))
+    assert list(spanned.ends) == [12000, 12000]
+    try:
+        arr.span(Interval.from_string('chr2:10500-12000'))
+        assert False
+    except Exception:
+        pass
+
+def test_Genome_interval_array():
+    genome = Genome('test/example.fa')
+    arr = genome.interval_array([10, 20], [20, 40], chrom='1', strand='+')
+    assert arr.chroms == ('1',)
+    i = arr[1]
+    assert i.genome is genome
+    assert i.strand == 1
+    assert i.sequence == genome.interval(20, 40, chrom='1').sequence